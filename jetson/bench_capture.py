@@ -0,0 +1,127 @@
+"""benchmark for camera frame freshness: direct reads vs the grabber thread
+
+a simulated V4L2 camera produces frames at --camera-fps into a queue of
+--driver-buffers buffers, dropping new frames while the queue is full as
+the driver does. a consumer that takes --process-ms per frame (detection,
+tracking, control) reads it through CameraSource, once directly and once
+through the grabber thread, and reports how old each frame was when it
+was read and when the consumer finished deciding on it (glass-to-decision),
+plus the process CPU time per frame read.
+
+with --camera, a real camera is read instead, through OpenCV or one of the
+GStreamer pipelines from gst_capture.py (--backend), to compare their CPU
+cost per frame.
+
+python3 bench_capture.py --process-ms 50
+python3 bench_capture.py --camera 0 --backend gstreamer --resolution 640x480
+"""
+
+import argparse
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_sources import CameraSource
+from gst_capture import BACKENDS, capture_pipeline
+
+
+class SimulatedCamera:
+    """Enough of cv2.VideoCapture for CameraSource, with a bounded driver queue."""
+    def __init__(self, fps, buffers, width=640, height=480):
+        self.period = 1.0 / fps
+        self.queue = queue.Queue(maxsize=buffers)
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.timestamp = 0.0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def produce(self):
+        next_tick = time.monotonic()
+        while not self.stopped:
+            next_tick += self.period
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            try:
+                self.queue.put_nowait(time.monotonic())
+            except queue.Full:
+                pass  # no free buffer: the driver drops the new frame
+
+    def read(self, image=None):
+        self.timestamp = self.queue.get()
+        if image is None or image.shape != self.frame.shape:
+            image = np.empty_like(self.frame)
+        image[:] = self.frame
+        return True, image
+
+    def get(self, prop):
+        return self.timestamp * 1000 if prop == cv2.CAP_PROP_POS_MSEC else 0.0
+
+    def set(self, prop, value):
+        return True
+
+    def release(self):
+        self.stopped = True
+
+
+def open_camera(spec, backend, width, height, fps):
+    """A real camera as CameraSource arguments: (device, width, height)."""
+    device = int(spec) if spec.isdigit() else spec
+    if backend == "opencv":
+        return device, width, height
+    pipeline = capture_pipeline(backend, device, width, height, fps)
+    if pipeline is None:
+        raise SystemExit("this OpenCV was built without GStreamer")
+    return cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER), None, None
+
+
+def run(camera, grab, frames, process_seconds):
+    source = CameraSource(*camera, grab=grab)
+    read_ages, decision_ages = [], []
+    cpu_start = time.process_time()
+    for _ in range(frames):
+        item = source.read()
+        if item is None:
+            break
+        _, captured_at, _ = item
+        read_ages.append(time.monotonic() - captured_at)
+        time.sleep(process_seconds)
+        decision_ages.append(time.monotonic() - captured_at)
+    cpu_ms = (time.process_time() - cpu_start) / max(1, len(read_ages)) * 1000
+    stats = source.stats()
+    source.release()
+    # The first few reads fill the driver queue; report steady state
+    skip = min(10, len(read_ages) // 2)
+    read_ages, decision_ages = np.array(read_ages[skip:]) * 1000, np.array(decision_ages[skip:]) * 1000
+    return {
+        "read_p50": np.percentile(read_ages, 50), "read_p95": np.percentile(read_ages, 95),
+        "decision_p50": np.percentile(decision_ages, 50), "decision_p95": np.percentile(decision_ages, 95),
+        "discarded": stats.get("discarded", 0),
+        "cpu_ms": cpu_ms
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--camera", type=str, default=None, help="Real camera index or device (default: simulated)")
+    parser.add_argument("--backend", choices=["opencv"] + list(BACKENDS), default="opencv")
+    parser.add_argument("--resolution", type=str, default="640x480")
+    parser.add_argument("--camera-fps", type=float, default=30)
+    parser.add_argument("--driver-buffers", type=int, default=4)
+    parser.add_argument("--process-ms", type=float, default=50)
+    parser.add_argument("--frames", type=int, default=60)
+    args = parser.parse_args()
+    width, height = map(int, args.resolution.split("x"))
+
+    print(f"consumer takes {args.process_ms:.0f}ms per frame; frame age in ms")
+    print(f"{'capture':>8} {'read p50':>9} {'read p95':>9} {'decide p50':>11} {'decide p95':>11} {'discarded':>10} {'cpu ms':>7}")
+    for name, grab in [("direct", False), ("grabber", True)]:
+        if args.camera is None:
+            camera = (SimulatedCamera(args.camera_fps, args.driver_buffers, width, height),)
+        else:
+            camera = open_camera(args.camera, args.backend, width, height, args.camera_fps)
+        result = run(camera, grab, args.frames, args.process_ms / 1000)
+        print(f"{name:>8} {result['read_p50']:>9.1f} {result['read_p95']:>9.1f} "
+              f"{result['decision_p50']:>11.1f} {result['decision_p95']:>11.1f} {result['discarded']:>10} {result['cpu_ms']:>7.2f}")
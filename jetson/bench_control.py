@@ -0,0 +1,185 @@
+"""benchmark for the motor control path, no car required
+
+starts a fake ESP32 on a pty (fake_esp32.py), points the server's command
+writer at it and drives the control path two ways:
+- /control: HTTP requests from a client, as the web UI sends them
+- autonomous: process_autonomous_movement on synthetic tracked boxes, as
+  the pipeline calls it every frame
+
+for each command the fake ESP32 applies, end-to-end latency is measured from
+the request (or autonomous decision) that asked for it. also reported: the
+rate of commands reaching the motors and how many the latest-wins writer
+superseded.
+
+python3 bench_control.py --rates 10 50 200 --duration 5
+"""
+
+import argparse
+import asyncio
+import bisect
+import contextlib
+import os
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+import train_demo_final as server
+from fake_esp32 import FakeESP32
+
+# Consecutive commands always differ and are never opposite, so
+# send_movement_command never dedups them or inserts a stop
+DIRECTIONS = ["forward", "left", "forward", "right"]
+DIRECTION_COMMANDS = {
+    "forward": server.Command.FORWARD,
+    "backward": server.Command.BACKWARD,
+    "left": server.Command.LEFT,
+    "right": server.Command.RIGHT,
+    "stop": server.Command.STOP
+}
+
+FRAME_WIDTH = 640
+OBSTACLE = "a bottle"
+
+
+def autonomous_scene(direction):
+    """Tracked boxes that make process_autonomous_movement pick direction."""
+    if direction == "forward":
+        return []
+    # An obstacle left of centre turns right and vice versa
+    center = FRAME_WIDTH * (0.4 if direction == "right" else 0.6)
+    box = (center - 40, 200, center + 40, 280)
+    return [server.TrackedBox(1, box, [OBSTACLE], [0.9])]
+
+
+def end_to_end_latency(requests, applied):
+    """Match each applied command to the latest request for that command
+    sent before it was applied; returns latencies in seconds."""
+    request_times = defaultdict(list)
+    for sent_at, direction in requests:
+        opcode = server.command_map[DIRECTION_COMMANDS[direction]]
+        request_times[opcode].append(sent_at)
+
+    latencies = []
+    for command in applied:
+        times = request_times[command.opcode]
+        i = bisect.bisect_right(times, command.time)
+        if i:
+            latencies.append(command.time - times[i - 1])
+    return latencies
+
+
+async def drive_control(session, url, rate, duration):
+    requests = []
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < duration:
+        direction = DIRECTIONS[i % len(DIRECTIONS)]
+        requests.append((time.perf_counter(), direction))
+        async with session.post(f"{url}/control", json={"direction": direction}) as response:
+            await response.read()
+        i += 1
+        await asyncio.sleep(max(0.0, start + i * interval - time.perf_counter()))
+    return requests
+
+
+async def drive_autonomous(rate, duration):
+    requests = []
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < duration:
+        direction = DIRECTIONS[i % len(DIRECTIONS)]
+        requests.append((time.perf_counter(), direction))
+        await server.process_autonomous_movement(autonomous_scene(direction), FRAME_WIDTH)
+        i += 1
+        await asyncio.sleep(max(0.0, start + i * interval - time.perf_counter()))
+    return requests
+
+
+async def settle(esp32):
+    """Send a stop and wait for the writer to go idle so runs don't overlap."""
+    server.send_movement_command("stop")
+    server.last_movement_command = None
+    server.current_control = None
+    await asyncio.sleep(server.command_writer.min_interval + 0.3)
+    esp32.take_applied()
+
+
+def report(out, mode, rate, requests, applied, duration, writer_before, writer_after):
+    latencies = np.array(end_to_end_latency(requests, applied)) * 1000
+    superseded = writer_after["dropped"] - writer_before["dropped"]
+    lost = writer_after["acks"]["lost"] - writer_before["acks"]["lost"]
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    else:
+        p50 = p95 = p99 = float("nan")
+    print(f"{mode:>10} {rate:>7.0f} {len(requests) / duration:>8.1f} {len(applied) / duration:>8.1f} "
+          f"{p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {superseded:>10} {lost:>5}", file=out, flush=True)
+
+
+async def main(args, out):
+    esp32 = FakeESP32(args.baud, args.drop, args.corrupt, byte_loss_rate=args.lose_byte).start()
+    server.SERIAL_DEVICE = esp32.path
+    server.command_writer.min_interval = args.command_delay
+    server.prompt_data = {"target_objects": ["a face"], "obstacles": [OBSTACLE]}
+
+    app = web.Application(middlewares=[server.latency_middleware])
+    app.router.add_post("/control", server.handle_control)
+    app.router.add_post("/motor-control", server.handle_motor_control)
+    app.router.add_post("/autonomous-control", server.handle_autonomous_control)
+    app.on_startup.append(server.start_command_writer)
+    app.on_cleanup.append(server.stop_command_writer)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    url = f"http://127.0.0.1:{args.port}"
+
+    print(f"fake ESP32 on {esp32.path}, {args.baud} baud, command delay {args.command_delay * 1000:.0f}ms", file=out)
+    print(f"{'mode':>10} {'rate':>7} {'req/s':>8} {'cmd/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'superseded':>10} {'lost':>5}", file=out)
+    async with aiohttp.ClientSession() as session:
+        for mode in args.modes:
+            await session.post(f"{url}/{'motor' if mode == 'control' else 'autonomous'}-control", json={"enabled": True})
+            for rate in args.rates:
+                await settle(esp32)
+                before = server.command_writer.stats()
+                if mode == "control":
+                    requests = await drive_control(session, url, rate, args.duration)
+                else:
+                    requests = await drive_autonomous(rate, args.duration)
+                await asyncio.sleep(server.ACK_TIMEOUT * 2)  # let the last commands land or time out
+                applied = esp32.take_applied()
+                report(out, mode, rate, requests, applied, args.duration, before, server.command_writer.stats())
+            await session.post(f"{url}/{'motor' if mode == 'control' else 'autonomous'}-control", json={"enabled": False})
+
+    rtt = server.command_writer.stats()["acks"]["rtt"]
+    print(f"ack round trip: p50 {rtt.get('p50_ms')}ms, p95 {rtt.get('p95_ms')}ms, p99 {rtt.get('p99_ms')}ms over {rtt['count']} acks", file=out)
+    if args.lose_byte:
+        print(f"fake ESP32 lost {esp32.lost_bytes} bytes; {esp32.received} frames reached the checksum, {esp32.rx_errors} errors", file=out)
+    await runner.cleanup()
+    esp32.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", choices=["control", "autonomous"], default=["control", "autonomous"])
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 50, 200], help="Commands per second to attempt")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    parser.add_argument("--command-delay", type=float, default=server.COMMAND_DELAY,
+                        help="Writer rate limit in seconds (server default COMMAND_DELAY)")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--drop", type=float, default=0.0, help="Fraction of frames the fake ESP32 loses")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Fraction of frames the fake ESP32 receives corrupted")
+    parser.add_argument("--lose-byte", type=float, default=0.0, help="Fraction of single bytes the fake ESP32 never receives")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--verbose", action="store_true", help="Keep the server's per-command logging")
+    args = parser.parse_args()
+    out = sys.stdout
+    # The server logs every command; keep only the results unless asked
+    with contextlib.redirect_stdout(out if args.verbose else open(os.devnull, "w")):
+        asyncio.run(main(args, out))
@@ -0,0 +1,74 @@
+"""benchmark for the stream JPEG encoders in jpeg_encoders.py
+
+encodes the same frames with every backend that is installed here and
+reports time per frame, achievable encode fps, output size and PSNR
+against the source frame, at one or more qualities.
+
+python3 bench_jpeg.py --resolution 1280x720 --qualities 50 80
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from jpeg_encoders import ENCODERS, available_encoders
+
+
+def make_frames(count, width, height):
+    """Camera-like frames: a gradient with noise and a few moving shapes."""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+    frames = []
+    for i in range(count):
+        frame = np.clip(gradient + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+        for j in range(4):
+            x = (i * 7 + j * width // 4) % width
+            cv2.circle(frame, (x, height // 2), height // 8, (60 * j, 255 - 60 * j, 128), -1)
+        frames.append(frame)
+    return frames
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def run(encoder, frames, repeats):
+    encoder.encode(frames[0])
+    times, sizes = [], []
+    for _ in range(repeats):
+        for frame in frames:
+            start = time.perf_counter()
+            jpeg = encoder.encode(frame)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(jpeg))
+    decoded = cv2.imdecode(np.frombuffer(encoder.encode(frames[-1]), dtype=np.uint8), cv2.IMREAD_COLOR)
+    median = float(np.median(times))
+    return {
+        "ms": median * 1000,
+        "fps": 1 / median,
+        "kb": float(np.mean(sizes)) / 1024,
+        "psnr": psnr(frames[-1], decoded)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolution", type=str, default="640x480")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--qualities", type=int, nargs="+", default=[50])
+    args = parser.parse_args()
+    width, height = map(int, args.resolution.split("x"))
+
+    frames = make_frames(args.frames, width, height)
+    names = available_encoders()
+    missing = [name for name in ENCODERS if name not in names]
+    print(f"{width}x{height}, {args.frames} frames x {args.repeats}" + (f" (not installed: {', '.join(missing)})" if missing else ""))
+    print(f"{'encoder':>11} {'quality':>8} {'ms/frame':>9} {'fps':>7} {'KB':>7} {'PSNR':>6}")
+    for quality in args.qualities:
+        for name in names:
+            result = run(ENCODERS[name](quality), frames, args.repeats)
+            print(f"{name:>11} {quality:>8} {result['ms']:>9.2f} {result['fps']:>7.0f} {result['kb']:>7.1f} {result['psnr']:>6.1f}")
@@ -0,0 +1,94 @@
+"""micro-benchmark for merge_overlapping_boxes
+
+times the two merge paths in train_demo_final.py, the original
+pure-Python one and the NumPy one, on synthetic OWL-style detections,
+along with merge_overlapping_boxes, which picks between them at
+MERGE_NUMPY_MIN_BOXES. checks that both paths give identical output, and
+prints the box count where NumPy starts to win, to set that threshold.
+
+python3 bench_merge.py --counts 8 16 32 48 64 128
+"""
+
+import argparse
+import copy
+import functools
+import random
+import time
+
+from nanoowl.tree_predictor import TreeDetection
+
+from train_demo_final import (
+    MERGE_NUMPY_MIN_BOXES, merge_overlapping_boxes, merge_sorted_boxes, merge_sorted_boxes_numpy
+)
+
+
+def make_detections(count, num_labels, width=640, height=480, seed=0):
+    """Clusters of jittered boxes, like OWL returns for one object seen several times."""
+    rng = random.Random(seed)
+    detections = [TreeDetection(id=0, parent_id=-1, box=(0., 0., float(width), float(height)), labels=[0], scores=[1.])]
+    while len(detections) < count + 1:
+        x = rng.uniform(0, width - 120)
+        y = rng.uniform(0, height - 120)
+        w = rng.uniform(30, 120)
+        h = rng.uniform(30, 120)
+        label = rng.randint(1, num_labels)
+        for _ in range(rng.randint(1, 4)):
+            jitter = [rng.gauss(0, 4) for _ in range(4)]
+            detections.append(TreeDetection(
+                id=len(detections),
+                parent_id=0,
+                box=(x + jitter[0], y + jitter[1], x + w + jitter[2], y + h + jitter[3]),
+                labels=[label],
+                scores=[rng.uniform(0.1, 0.9)]
+            ))
+    return detections[:count + 1]
+
+
+def sorted_path(merge_fn, detections, iou_threshold):
+    """One merge path on its own, with merge_overlapping_boxes' filtering and sort."""
+    boxes = sorted((d for d in detections if d.id != 0), key=lambda x: x.scores[0], reverse=True)
+    return [d for d in detections if d.id == 0] + merge_fn(boxes, iou_threshold)
+
+
+def time_merge(merge_fn, detections, iou_threshold, repeat):
+    """Mean milliseconds per call. Copies are made up front since merging mutates its input."""
+    inputs = [copy.deepcopy(detections) for _ in range(repeat)]
+    start = time.perf_counter()
+    for batch in inputs:
+        merge_fn(batch, iou_threshold)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def summarize(detections):
+    return [(d.id, d.box, tuple(d.labels), tuple(d.scores)) for d in detections]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[8, 16, 32, 48, 64, 128])
+    parser.add_argument("--labels", type=int, default=8)
+    parser.add_argument("--iou", type=float, default=0.6)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    python_path = functools.partial(sorted_path, merge_sorted_boxes)
+    numpy_path = functools.partial(sorted_path, merge_sorted_boxes_numpy)
+    print(f"merge_overlapping_boxes uses NumPy from {MERGE_NUMPY_MIN_BOXES} boxes")
+    crossover = None  # smallest count from which NumPy wins at every larger count
+    print(f"{'boxes':>6} {'python':>10} {'numpy':>10} {'merge':>10} {'numpy speedup':>14}  identical")
+    for count in args.counts:
+        detections = make_detections(count, args.labels, seed=count)
+
+        expected = python_path(copy.deepcopy(detections), args.iou)
+        actual = numpy_path(copy.deepcopy(detections), args.iou)
+        identical = summarize(expected) == summarize(actual)
+
+        python_ms = time_merge(python_path, detections, args.iou, args.repeat)
+        numpy_ms = time_merge(numpy_path, detections, args.iou, args.repeat)
+        merge_ms = time_merge(merge_overlapping_boxes, detections, args.iou, args.repeat)
+        if numpy_ms >= python_ms:
+            crossover = None
+        elif crossover is None:
+            crossover = count
+        print(f"{count:>6} {python_ms:>8.3f}ms {numpy_ms:>8.3f}ms {merge_ms:>8.3f}ms {python_ms / numpy_ms:>13.1f}x  {identical}")
+    print(f"NumPy wins from {crossover} boxes up" if crossover else "NumPy does not win at the largest count")
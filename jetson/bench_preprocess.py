@@ -0,0 +1,192 @@
+"""benchmark for the predictor input path
+
+compares, per frame, the old path (fresh frame from VideoCapture.read,
+cv2_to_pil, then np.asarray inside nanoowl's preprocess_pil_image) with the
+BGR path in train_demo_final.py (read into a FrameRing, copy into the
+inference ring, wrap in a BgrFrame). reports time, frame-sized allocations
+and host copies (measured by buffer identity) and peak traced memory per frame.
+if torch and nanoowl's ImagePreprocessor are usable, also checks the
+device-side BgrImagePreprocessor output against preprocess_pil_image, and
+with --engine, runs TreePredictor.predict on a BgrFrame after
+install_bgr_input, as the server does.
+
+python3 bench_preprocess.py --resolution 1280x720 --frames 300
+python3 bench_preprocess.py --engine ../../data/owl_image_encoder_patch32.engine
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import PIL.Image
+
+import train_demo_final as server
+from frame_sources import VideoFileSource
+
+
+def make_video(path, frames, width, height, fps=30):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    rng = np.random.default_rng(0)
+    for i in range(frames):
+        frame = np.full((height, width, 3), i % 256, dtype=np.uint8)
+        cv2.rectangle(frame, (i % width, 40), (i % width + 80, 160), rng.integers(0, 255, 3).tolist(), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def read_frame(source):
+    item = source.read()
+    return None if item is None else item[0]
+
+
+def pil_path(source, infer_ring):
+    """Old path, as in the original capture loop: decode into a new array,
+    cv2_to_pil, then np.asarray inside preprocess_pil_image."""
+    return [
+        lambda _: read_frame(source),
+        lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),  # server.cv2_to_pil, one step at a time
+        PIL.Image.fromarray,
+        np.asarray,
+    ]
+
+
+def bgr_path(source, infer_ring):
+    """BGR path: decode into a ring buffer, copy into the inference ring, wrap in a BgrFrame."""
+    return [
+        lambda _: read_frame(source),
+        infer_ring.copy,
+        server.BgrFrame,
+    ]
+
+
+def pillow_blocks():
+    stats = PIL.Image.core.get_stats()
+    return stats["allocated_blocks"] + stats["reused_blocks"]
+
+
+def run(path_fn, video, frames, use_ring):
+    """Time each path and count, per step, whether its output landed in a newly
+    allocated host buffer (no memory shared with the ring buffers or the step's
+    input) and whether it copied its input (no memory shared with it). Pillow's
+    image storage is invisible to numpy and tracemalloc, so a PIL output counts
+    as allocated and copied when Pillow hands out a block for it."""
+    source = VideoFileSource(video, realtime=False)
+    infer_ring = server.FrameRing(3)
+    if use_ring:
+        source.ring = server.FrameRing(8)
+    steps = path_fn(source, infer_ring)
+
+    times, peaks, allocations, copies = [], [], [], []
+    tracemalloc.start()
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        elapsed = 0.0
+        frame_allocations = frame_copies = 0
+        value = None
+        for i, step in enumerate(steps):
+            known = [*getattr(source.ring, "buffers", []), *infer_ring.buffers]
+            blocks = pillow_blocks()
+            start = time.perf_counter()
+            output = step(value)
+            elapsed += time.perf_counter() - start
+            if output is None:
+                break
+            if isinstance(output, PIL.Image.Image):
+                fresh = copied = pillow_blocks() > blocks
+            else:
+                array = output.array if isinstance(output, server.BgrFrame) else output
+                fresh = not any(np.shares_memory(array, buffer) for buffer in known)
+                copied = i > 0 and not (isinstance(value, np.ndarray) and np.shares_memory(array, value))
+            frame_allocations += fresh
+            frame_copies += copied
+            value = output
+        if output is None:
+            break
+        times.append(elapsed)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        allocations.append(frame_allocations)
+        copies.append(frame_copies)
+        del value, output
+    tracemalloc.stop()
+    source.release()
+
+    # The ring path decodes its first frame into a new array, then sizes the
+    # rings on the second; report steady state
+    steady = slice(2, None) if len(times) > 2 else slice(None)
+    return {
+        "ms": float(np.median(times[steady]) * 1000),
+        "allocs": float(np.mean(allocations[steady])),
+        "copies": float(np.mean(copies[steady])),
+        "peak_kb": float(np.median(peaks[steady])) / 1024
+    }
+
+
+def check_device(width, height, engine=None):
+    try:
+        import torch
+        from nanoowl.image_preprocessor import ImagePreprocessor
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        preprocessor = ImagePreprocessor().to(device).eval()
+    except Exception as e:
+        print(f"device check skipped: {e}")
+        return
+    frame = np.random.default_rng(1).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    bgr = server.BgrImagePreprocessor(preprocessor)
+    expected = preprocessor.preprocess_pil_image(server.cv2_to_pil(frame))
+    actual = bgr.preprocess_bgr(frame)
+    print(f"device ({device}) max abs difference vs preprocess_pil_image: {(expected - actual).abs().max().item():.2e}")
+
+    for name, fn in [("pil", lambda: preprocessor.preprocess_pil_image(server.cv2_to_pil(frame))),
+                     ("bgr", lambda: bgr.preprocess_bgr(frame))]:
+        fn()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(50):
+            fn()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        print(f"device {name}: {(time.perf_counter() - start) / 50 * 1000:.2f}ms per frame")
+
+    if engine:
+        check_predictor(frame, engine)
+
+
+def check_predictor(frame, engine, prompt="[a face, a hand, a bottle]"):
+    """Install the BGR path on a real TreePredictor, as the server does, and
+    compare TreePredictor.predict on a BgrFrame with predict on the PIL image."""
+    server.predictor = server.TreePredictor(owl_predictor=server.OwlPredictor(image_encoder_engine=engine))
+    tree, clip_encodings, owl_encodings = server.encode_prompt(prompt)
+    kwargs = dict(tree=tree, clip_text_encodings=clip_encodings, owl_text_encodings=owl_encodings, threshold=0.1)
+    expected = server.predictor.predict(server.cv2_to_pil(frame), **kwargs).detections
+    if not server.install_bgr_input(server.predictor):
+        print("predictor check failed: install_bgr_input found no image preprocessor")
+        return
+    actual = server.predictor.predict(server.BgrFrame(frame), **kwargs).detections
+    difference = max((np.abs(np.subtract(a.box, b.box)).max() for a, b in zip(expected, actual)), default=0.0)
+    print(f"TreePredictor.predict with BgrFrame: {len(actual)} detections ({len(expected)} with PIL), "
+          f"max box difference {difference:.2f}px")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolution", type=str, default="640x480")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--engine", type=str, default=None,
+                        help="OWL image encoder engine: also check the BGR path through TreePredictor.predict")
+    args = parser.parse_args()
+    width, height = map(int, args.resolution.split("x"))
+
+    video = os.path.join(tempfile.mkdtemp(prefix="preprocess_"), "frames.avi")
+    make_video(video, args.frames, width, height)
+
+    print(f"{width}x{height}, {args.frames} frames (decode + input preparation, host side)")
+    print(f"{'path':>5} {'ms/frame':>9} {'allocs':>7} {'copies':>7} {'peak KB':>9}")
+    for name, path_fn, use_ring in [("pil", pil_path, False), ("bgr", bgr_path, True)]:
+        result = run(path_fn, video, args.frames, use_ring)
+        print(f"{name:>5} {result['ms']:>9.3f} {result['allocs']:>7.2f} {result['copies']:>7.2f} {result['peak_kb']:>9.0f}")
+    check_device(width, height, args.engine)
@@ -0,0 +1,212 @@
+"""replay benchmark and regression check for the detection/tracking/control pipeline
+
+runs FramePipeline from train_demo_final.py end to end on a recorded
+session, with ReplayPredictor standing in for the detector, in lockstep at
+max speed. prints pipeline throughput and a digest of every autonomous
+command and the final tracks; the digest is identical on every run, so a
+change to merge, tracking or control logic shows up as a different digest.
+
+with no --session, a synthetic session is generated first: objects
+(targets and obstacles) drifting across the frame, with jittered
+detections and occasional misses.
+
+with --record, one more run records a session with SessionRecorder (to
+show its cost against the plain runs) and that recording is replayed again,
+which must give the same digest.
+
+with --roi/--infer-size the detector input is cropped/resized as in the
+server, and the replayed detections are mapped into that image and back.
+
+python3 bench_replay.py --runs 3 --record
+python3 bench_replay.py --roi 0,0.33,1,1 --infer-size 384x256
+python3 bench_replay.py --session sessions/2025-02-15_1402 --expect 3f2a...
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from nanoowl.tree_predictor import TreeDetection
+
+import train_demo_final as server
+from frame_sources import SessionSource
+from replay_predictor import ReplayPredictor
+from session_log import SessionRecorder, SessionWriter, detection_rows
+
+TARGETS = ["a face", "a hand"]
+OBSTACLES = ["a bottle", "a can"]
+
+
+def make_session(path, num_frames, num_objects, width=640, height=480, fps=30.0, seed=0, still=(), noise=0.0):
+    """Write a synthetic session: rectangles on a grey frame, plus the detections for them.
+    Objects hold still on the frame numbers in still; noise adds Gaussian sensor noise."""
+    rng = random.Random(seed)
+    noise_rng = np.random.default_rng(seed)
+    labels = ["image"] + TARGETS + OBSTACLES
+    label_map = dict(enumerate(labels))
+    objects = []
+    for _ in range(num_objects):
+        w, h = rng.uniform(40, 160), rng.uniform(40, 160)
+        objects.append({
+            "x": rng.uniform(0, width - w), "y": rng.uniform(0, height - h), "w": w, "h": h,
+            "vx": rng.uniform(-4, 4), "vy": rng.uniform(-2, 2),
+            "label": rng.randint(1, len(labels) - 1)
+        })
+
+    writer = SessionWriter(path)
+    for frame_index in range(num_frames):
+        t = frame_index / fps
+        frame = np.full((height, width, 3), 96, dtype=np.uint8)
+        detections = [TreeDetection(id=0, parent_id=-1, box=(0., 0., float(width), float(height)), labels=[0], scores=[1.])]
+        for obj in objects:
+            if frame_index not in still:
+                obj["x"] = min(max(obj["x"] + obj["vx"], 0), width - obj["w"])
+                obj["y"] = min(max(obj["y"] + obj["vy"], 0), height - obj["h"])
+                if obj["x"] in (0, width - obj["w"]):
+                    obj["vx"] = -obj["vx"]
+            box = (obj["x"], obj["y"], obj["x"] + obj["w"], obj["y"] + obj["h"])
+            color = (40 * obj["label"], 255 - 40 * obj["label"], 128)
+            cv2.rectangle(frame, (int(box[0]), int(box[1])), (int(box[2]), int(box[3])), color, -1)
+            if rng.random() < 0.05:
+                continue
+            detections.append(TreeDetection(
+                id=len(detections), parent_id=0,
+                box=tuple(v + rng.gauss(0, 1.5) for v in box),
+                labels=[obj["label"]], scores=[rng.uniform(0.3, 0.9)]
+            ))
+        if noise:
+            frame = np.clip(frame + noise_rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+        _, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        writer.write_frame(frame_index, t, jpeg.tobytes())
+        writer.write_detections(frame_index, t, detection_rows(detections, label_map))
+    writer.close()
+
+
+class CommandLog:
+    """Takes the command writer's place and records every command submitted."""
+    def __init__(self):
+        self.commands = []
+
+    def submit(self, command):
+        self.commands.append(command.name)
+
+
+class FrameCounter:
+    """Takes the broadcaster's place: counts streamed frames and notes the end of the stream."""
+    def __init__(self):
+        self.frames = 0
+        self.finished = asyncio.Event()
+
+    def levels_in_use(self):
+        return set()
+    
+    def publish(self, frames):
+        if frames is None:
+            self.finished.set()
+        else:
+            self.frames += 1
+
+
+async def replay(session_path, recorder=None):
+    """Run the pipeline over the whole session; returns (frames, seconds, pipeline, commands, final tracks)."""
+    server.session_recorder = recorder
+    server.track_table = server.TrackTable()
+    server.last_movement_command = None
+    server.command_writer = CommandLog()
+    server.DETECTION_INTERVAL = 0.0
+
+    counter = FrameCounter()
+    pipeline = server.FramePipeline(
+        counter, source_factory=lambda: SessionSource(session_path, realtime=False), lockstep=True
+    )
+    start = time.perf_counter()
+    await pipeline.run()
+    elapsed = time.perf_counter() - start
+
+    tracks = [(box.track_id, tuple(round(float(v), 3) for v in box.box), tuple(box.labels))
+              for box in server.track_table.valid_boxes()]
+    return counter.frames, elapsed, pipeline, server.command_writer.commands, tracks
+
+
+def digest(commands, tracks):
+    return hashlib.sha1(repr((commands, tracks)).encode()).hexdigest()[:16]
+
+
+async def main(args):
+    session_path = args.session
+    if session_path is None:
+        session_path = os.path.join(tempfile.mkdtemp(prefix="replay_"), "session")
+        make_session(session_path, args.frames, args.objects, seed=args.seed)
+        print(f"📼 Synthetic session: {args.frames} frames, {args.objects} objects in {session_path}")
+
+    server.predictor = ReplayPredictor(session_path, latency=args.latency)
+    server.BGR_INPUT = server.install_bgr_input(server.predictor)
+    if args.roi:
+        server.INFERENCE_ROI = tuple(float(v) for v in args.roi.split(","))
+    if args.infer_size:
+        server.INFERENCE_SIZE = tuple(map(int, args.infer_size.split("x")))
+    tree, clip_encodings, owl_encodings = server.encode_prompt(f"[{', '.join(TARGETS + OBSTACLES)}]")
+    server.prompt_data = {
+        "tree": tree,
+        "clip_encodings": clip_encodings,
+        "owl_encodings": owl_encodings,
+        "target": "entrapped survivor",
+        "target_objects": TARGETS,
+        "obstacles": OBSTACLES
+    }
+    server.autonomous_control_enabled = True
+
+    digests = set()
+    for run in range(args.runs):
+        frames, elapsed, pipeline, commands, tracks = await replay(session_path)
+        run_digest = digest(commands, tracks)
+        digests.add(run_digest)
+        stages = pipeline.stats()["stages"]
+        print(f"run {run + 1}: {frames} frames in {elapsed:.2f}s ({frames / elapsed:.1f} fps), "
+              f"{len(commands)} commands, {len(tracks)} tracks, digest {run_digest}")
+        print("        " + ", ".join(f"{name} p50 {s['p50_ms']}ms" for name, s in stages.items() if s["count"]))
+
+    if args.record:
+        recording_path = os.path.join(tempfile.mkdtemp(prefix="recording_"), "session")
+        recorder = SessionRecorder(recording_path)
+        frames, elapsed, pipeline, commands, tracks = await replay(session_path, recorder)
+        recorder.close()
+        stats = recorder.stats()
+        print(f"recorded: {frames} frames in {elapsed:.2f}s ({frames / elapsed:.1f} fps), "
+              f"{stats['recorded']} records, {stats['dropped']} dropped, "
+              f"{stats['frame_bytes'] / 1e6:.1f}MB of JPEG, {stats['write_ms']}ms writing, in {recording_path}")
+        digests.add(digest(commands, tracks))
+
+        server.predictor = ReplayPredictor(recording_path, latency=args.latency)
+        frames, elapsed, pipeline, commands, tracks = await replay(recording_path)
+        print(f"replayed recording: {frames} frames, digest {digest(commands, tracks)}")
+        digests.add(digest(commands, tracks))
+
+    if len(digests) > 1:
+        print(f"❌ Replay is not deterministic: {sorted(digests)}")
+    elif args.expect and args.expect not in digests:
+        print(f"❌ Digest changed: expected {args.expect}, got {digests.pop()}")
+    else:
+        print("✅ Replay deterministic" + (" and matches expected digest" if args.expect else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--session", type=str, default=None, help="Recorded session to replay (default: synthetic)")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--objects", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated detector time per frame (s)")
+    parser.add_argument("--roi", type=str, default=None, help="Detector ROI as x0,y0,x1,y1 fractions")
+    parser.add_argument("--infer-size", type=str, default=None, help="Detector input size, WIDTHxHEIGHT")
+    parser.add_argument("--record", action="store_true", help="Also record a run and replay the recording")
+    parser.add_argument("--expect", type=str, default=None, help="Digest a previous run printed")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,115 @@
+"""benchmark for the scene-change gate in train_demo_final.py
+
+replays a synthetic session through FramePipeline in lockstep with the
+robot stopped: objects move for the first and last --moving frames and
+hold still (with sensor noise) in between. runs once with the gate off
+and once with it on, with ReplayPredictor sleeping --latency per
+detector call to stand in for the GPU, and reports detector runs in the
+moving and idle stretches, detector time, and how far the streamed
+tracks strayed from the ungated run.
+
+python3 bench_scene_gate.py --latency 0.03 --threshold 0.005
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import train_demo_final as server
+from bench_replay import FrameCounter, CommandLog, TARGETS, OBSTACLES, make_session
+from frame_sources import SessionSource
+from replay_predictor import ReplayPredictor
+
+
+class CountingPredictor(ReplayPredictor):
+    """ReplayPredictor that notes which frames it was asked to detect."""
+    def __init__(self, session_path, latency):
+        super().__init__(session_path, latency)
+        self.detected = []
+
+    def predict(self, image, tree, *args, frame_index=None, **kwargs):
+        self.detected.append(frame_index)
+        return super().predict(image, tree, *args, frame_index=frame_index, **kwargs)
+
+
+class TrackLog:
+    """Wraps overlay_frame to keep the boxes streamed with every frame."""
+    def __init__(self):
+        self.boxes = {}
+        self.overlay_frame = server.overlay_frame
+
+    def __call__(self, packet, tracks, stage_latency):
+        self.overlay_frame(packet, tracks, stage_latency)
+        self.boxes[packet.frame_index] = {box.track_id: np.array(box.box) for box in packet.valid_boxes}
+
+
+async def run(session_path, gate, latency):
+    server.SCENE_GATE = gate
+    server.predictor = CountingPredictor(session_path, latency)
+    server.track_table = server.TrackTable()
+    server.last_movement_command = None  # stopped
+    server.command_writer = CommandLog()
+    server.DETECTION_INTERVAL = 0.0
+    log = TrackLog()
+    server.overlay_frame = log
+    pipeline = server.FramePipeline(
+        FrameCounter(), source_factory=lambda: SessionSource(session_path, realtime=False), lockstep=True
+    )
+    start = time.perf_counter()
+    await pipeline.run()
+    elapsed = time.perf_counter() - start
+    server.overlay_frame = log.overlay_frame
+    return pipeline, server.predictor.detected, log.boxes, elapsed
+
+
+def box_drift(reference, boxes):
+    """Mean distance (px) between box corners of tracks streamed in both runs."""
+    distances = []
+    for frame, tracks in reference.items():
+        for track_id, box in tracks.items():
+            if track_id in boxes.get(frame, {}):
+                distances.append(np.abs(boxes[frame][track_id] - box).mean())
+    return float(np.mean(distances)) if distances else 0.0
+
+
+async def main(args):
+    total = args.moving * 2 + args.idle
+    idle = range(args.moving, args.moving + args.idle)
+    session_path = os.path.join(tempfile.mkdtemp(prefix="scene_gate_"), "session")
+    make_session(session_path, total, args.objects, still=idle, noise=args.noise)
+    server.predictor = ReplayPredictor(session_path)
+    server.BGR_INPUT = server.install_bgr_input(server.predictor)
+    tree, clip_encodings, owl_encodings = server.encode_prompt(f"[{', '.join(TARGETS + OBSTACLES)}]")
+    server.prompt_data = {"tree": tree, "clip_encodings": clip_encodings, "owl_encodings": owl_encodings,
+                          "target_objects": TARGETS, "obstacles": OBSTACLES}
+    server.autonomous_control_enabled = False
+    server.SCENE_CHANGE_THRESHOLD = args.threshold
+
+    print(f"{total} frames: {args.moving} moving, {args.idle} still, {args.moving} moving; "
+          f"{args.latency * 1000:.0f}ms per detector call, threshold {args.threshold}")
+    print(f"{'gate':>4} {'moving runs':>12} {'idle runs':>10} {'detector s':>11} {'est. saved s':>13} {'wall s':>7} {'drift px':>9}")
+    reference = None
+    for gate in (False, True):
+        pipeline, detected, boxes, elapsed = await run(session_path, gate, args.latency)
+        idle_runs = sum(frame in idle for frame in detected)
+        infer = pipeline.stage_latency["infer"]
+        saved = pipeline.gate.stats(infer)["gpu_seconds_saved"]
+        reference = reference or boxes
+        print(f"{'on' if gate else 'off':>4} {len(detected) - idle_runs:>12} {idle_runs:>10} {infer.total:>11.2f} "
+              f"{saved:>13.2f} {elapsed:>7.2f} {box_drift(reference, boxes):>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--moving", type=int, default=90, help="Frames of motion before and after the still stretch")
+    parser.add_argument("--idle", type=int, default=300, help="Frames the scene holds still")
+    parser.add_argument("--objects", type=int, default=6)
+    parser.add_argument("--noise", type=float, default=3.0, help="Sensor noise standard deviation (grey levels)")
+    parser.add_argument("--latency", type=float, default=0.03, help="Simulated detector time per call (s)")
+    parser.add_argument("--threshold", type=float, default=server.SCENE_CHANGE_THRESHOLD)
+    args = parser.parse_args()
+    asyncio.run(main(args))
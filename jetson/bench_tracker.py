@@ -0,0 +1,142 @@
+"""benchmark for update_tracked_boxes
+
+runs the track table in train_demo_final.py and the original greedy
+list-of-objects tracker over synthetic scenes with a growing number of
+moving objects, and reports per-frame update time plus how often the
+greedy matcher let two detections update the same track.
+
+python3 bench_tracker.py --tracks 10 50 100 200
+"""
+
+import argparse
+import random
+import time
+
+from nanoowl.tree_predictor import TreeDetection
+
+import train_demo_final as server
+
+
+class TrackedBoxReference:
+    """Original per-object track record."""
+    def __init__(self, detection, label_map):
+        self.box = detection.box
+        self.labels = [label_map[label] for label in detection.labels]
+        self.scores = detection.scores
+        self.frame_count = 1
+        self.missing_frames = 0
+        self.last_seen = time.time()
+
+    def update(self, new_detection, label_map):
+        self.box = new_detection.box
+        self.labels = [label_map[label] for label in new_detection.labels]
+        self.scores = new_detection.scores
+        self.frame_count += 1
+        self.missing_frames = 0
+        self.last_seen = time.time()
+
+    def mark_missing(self):
+        self.missing_frames += 1
+
+
+def update_tracked_boxes_reference(tracked_boxes, detections, label_map):
+    """Original greedy matcher. Returns the new track list and how many
+    detections updated a track that another detection already updated."""
+    for box in tracked_boxes:
+        box.mark_missing()
+
+    matched_detections = set()
+    updated_tracks = set()
+    collisions = 0
+    for i, detection in enumerate(detections):
+        if detection.id == 0:
+            continue
+
+        best_match = None
+        best_iou = server.IOU_THRESHOLD
+        for tracked_box in tracked_boxes:
+            iou = server.calculate_iou(detection.box, tracked_box.box)
+            if iou > best_iou:
+                best_iou = iou
+                best_match = tracked_box
+
+        if best_match is not None:
+            if id(best_match) in updated_tracks:
+                collisions += 1
+            updated_tracks.add(id(best_match))
+            best_match.update(detection, label_map)
+            matched_detections.add(i)
+
+    for i, detection in enumerate(detections):
+        if detection.id != 0 and i not in matched_detections:
+            tracked_boxes.append(TrackedBoxReference(detection, label_map))
+
+    tracked_boxes = [box for box in tracked_boxes if box.missing_frames < server.MISSING_THRESHOLD]
+    return tracked_boxes, collisions
+
+
+def make_scene(num_objects, num_frames, num_labels, width=1280, height=720, seed=0):
+    """Objects drifting across the frame, with jittered detections and occasional misses."""
+    rng = random.Random(seed)
+    objects = []
+    for _ in range(num_objects):
+        w, h = rng.uniform(20, 80), rng.uniform(20, 80)
+        objects.append({
+            "x": rng.uniform(0, width - w), "y": rng.uniform(0, height - h),
+            "w": w, "h": h,
+            "vx": rng.uniform(-3, 3), "vy": rng.uniform(-3, 3),
+            "label": rng.randint(1, num_labels)
+        })
+
+    frames = []
+    for _ in range(num_frames):
+        detections = [TreeDetection(id=0, parent_id=-1, box=(0., 0., float(width), float(height)), labels=[0], scores=[1.])]
+        for obj in objects:
+            obj["x"] += obj["vx"]
+            obj["y"] += obj["vy"]
+            if rng.random() < 0.05:
+                continue
+            jitter = [rng.gauss(0, 1.5) for _ in range(4)]
+            detections.append(TreeDetection(
+                id=len(detections),
+                parent_id=0,
+                box=(obj["x"] + jitter[0], obj["y"] + jitter[1],
+                     obj["x"] + obj["w"] + jitter[2], obj["y"] + obj["h"] + jitter[3]),
+                labels=[obj["label"]],
+                scores=[rng.uniform(0.2, 0.9)]
+            ))
+        rng.shuffle(detections)
+        frames.append(detections)
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--labels", type=int, default=8)
+    args = parser.parse_args()
+
+    label_map = {i: f"label {i}" for i in range(args.labels + 1)}
+    solver = "hungarian" if server.linear_sum_assignment is not None else "greedy fallback"
+    print(f"matcher: {solver}, label gating: {server.LABEL_GATING}")
+    print(f"{'tracks':>6} {'greedy':>12} {'assignment':>12} {'per track':>10}  greedy collisions")
+    for num_objects in args.tracks:
+        frames = make_scene(num_objects, args.frames, args.labels, seed=num_objects)
+
+        tracked_boxes = []
+        collisions = 0
+        start = time.perf_counter()
+        for detections in frames:
+            tracked_boxes, frame_collisions = update_tracked_boxes_reference(tracked_boxes, detections, label_map)
+            collisions += frame_collisions
+        greedy_ms = (time.perf_counter() - start) / len(frames) * 1000
+
+        server.track_table = server.TrackTable()
+        start = time.perf_counter()
+        for detections in frames:
+            server.update_tracked_boxes(detections, label_map)
+        assignment_ms = (time.perf_counter() - start) / len(frames) * 1000
+
+        per_track_us = assignment_ms / num_objects * 1000
+        print(f"{num_objects:>6} {greedy_ms:>10.3f}ms {assignment_ms:>10.3f}ms {per_track_us:>8.1f}us  {collisions}")
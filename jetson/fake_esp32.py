@@ -0,0 +1,214 @@
+"""pty-backed stand-in for the ESP32 motor controller
+
+emulates treehacks_rc_car/src/main.cpp on the other end of a pseudo
+terminal: the same sync-byte frame state machine and acks, with each byte
+taking as long as it would on a 115200 baud 8N1 wire in both directions.
+every applied command is timestamped so benchmarks can measure end-to-end
+latency. point the server at the printed pty:
+
+python3 fake_esp32.py --drop 0.01
+python3 train_demo_final.py ../../data/owl_image_encoder_patch32.engine --serial /dev/pts/N
+"""
+
+import argparse
+import os
+import pty
+import queue
+import random
+import select
+import threading
+import time
+import tty
+from collections import namedtuple
+
+import serial_protocol
+
+BITS_PER_BYTE = 10  # 8N1: start bit + 8 data bits + stop bit
+
+OPCODE_NAMES = {
+    serial_protocol.OP_STOP: "Stop",
+    serial_protocol.OP_FORWARD: "Moving forward",
+    serial_protocol.OP_BACKWARD: "Moving backward",
+    serial_protocol.OP_TURN_LEFT: "Turning left",
+    serial_protocol.OP_TURN_RIGHT: "Turning right"
+}
+
+AppliedCommand = namedtuple("AppliedCommand", ["time", "seq", "opcode", "speed"])
+
+
+class FakeESP32:
+    """
+    Firmware emulator on a pty. The receive thread delivers bytes no faster
+    than the baud rate and runs them through the firmware's frame state
+    machine; acks are queued to a transmit thread that holds each one for
+    its own wire time, so the UART is full duplex as on the real board.
+    drop_rate loses whole command frames (no ack), corrupt_rate flips a
+    byte so the firmware answers with a bad-checksum ack, and byte_loss_rate
+    loses single bytes on the wire, leaving the firmware to resync.
+    """
+    def __init__(self, baudrate=serial_protocol.BAUD_RATE, drop_rate=0.0, corrupt_rate=0.0, seed=0, verbose=False,
+                 byte_loss_rate=0.0):
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.byte_loss_rate = byte_loss_rate
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)  # no echo or line editing, like a UART
+        self.path = os.ttyname(self.slave_fd)
+
+        # Firmware state
+        self.frame = bytearray()
+        self.rx_errors = 0
+        self.motor_speed = 255
+        self.opcode = serial_protocol.OP_STOP
+
+        self.lock = threading.Lock()
+        self.applied = []  # AppliedCommand for every OK frame
+        self.received = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.lost_bytes = 0
+
+        self.rx_free_at = 0.0  # when the last received byte finished arriving
+        self.tx_free_at = 0.0
+        self.tx_queue = queue.Queue()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.receive, name="fake-esp32-rx", daemon=True),
+            threading.Thread(target=self.transmit, name="fake-esp32-tx", daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.tx_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def take_applied(self):
+        """Applied commands since the last call."""
+        with self.lock:
+            applied, self.applied = self.applied, []
+        return applied
+
+    def receive(self):
+        while self.running:
+            ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                return
+            arrived = time.perf_counter()
+            for incoming in data:
+                # Each byte lands one byte-time after the previous one finished
+                self.rx_free_at = max(arrived, self.rx_free_at) + self.byte_time
+                if self.byte_loss_rate and self.rng.random() < self.byte_loss_rate:
+                    self.lost_bytes += 1
+                    continue
+                self.on_byte(incoming)
+
+    def on_byte(self, incoming):
+        """Serial2 read loop from main.cpp."""
+        if not self.frame and incoming != serial_protocol.COMMAND_SYNC:
+            return
+        self.frame.append(incoming)
+        if len(self.frame) == serial_protocol.COMMAND_FRAME_SIZE:
+            wait = self.rx_free_at - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            if self.handle_frame(self.frame):
+                self.frame = bytearray()
+            else:
+                self.resync()
+
+    def resync(self):
+        """resync() from main.cpp: drop the first byte and resume at the next
+        sync byte in the buffer."""
+        start = self.frame.find(serial_protocol.COMMAND_SYNC, 1)
+        self.frame = self.frame[start:] if start > 0 else bytearray()
+
+    def handle_frame(self, frame):
+        """handleFrame() from main.cpp, plus fault injection. False if the
+        checksum is bad and the frame was not consumed."""
+        self.received += 1
+        if self.rng.random() < self.drop_rate:
+            self.dropped += 1
+            return True
+        if self.rng.random() < self.corrupt_rate:
+            # Corrupted on the wire, so the buffered byte is the bad one
+            self.corrupted += 1
+            frame[3] ^= 0xFF
+
+        seq, opcode, speed, checksum = frame[1:]
+        if serial_protocol.crc8(frame[1:4]) != checksum:
+            self.rx_errors = (self.rx_errors + 1) & 0xFF
+            self.send_ack(seq, serial_protocol.STATUS_BAD_CHECKSUM, opcode)
+            return False
+
+        self.motor_speed = speed
+        if opcode not in OPCODE_NAMES:
+            self.opcode = serial_protocol.OP_STOP
+            self.rx_errors = (self.rx_errors + 1) & 0xFF
+            self.send_ack(seq, serial_protocol.STATUS_BAD_OPCODE, opcode)
+            return True
+
+        self.opcode = opcode
+        with self.lock:
+            self.applied.append(AppliedCommand(time.perf_counter(), seq, opcode, speed))
+        if self.verbose:
+            print(f"UART: {OPCODE_NAMES[opcode]} (speed {speed})")
+        self.send_ack(seq, serial_protocol.STATUS_OK, opcode)
+        return True
+
+    def send_ack(self, seq, status, opcode):
+        ack = serial_protocol.encode_ack(seq, status, opcode, self.rx_errors)
+        self.tx_free_at = max(time.perf_counter(), self.tx_free_at) + len(ack) * self.byte_time
+        self.tx_queue.put((self.tx_free_at, ack))
+
+    def transmit(self):
+        while True:
+            item = self.tx_queue.get()
+            if item is None:
+                return
+            deliver_at, ack = item
+            wait = deliver_at - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                os.write(self.master_fd, ack)
+            except OSError:
+                return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baud", type=int, default=serial_protocol.BAUD_RATE)
+    parser.add_argument("--drop", type=float, default=0.0, help="Fraction of command frames lost without an ack")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Fraction of command frames corrupted in transit")
+    parser.add_argument("--lose-byte", type=float, default=0.0, help="Fraction of single bytes lost in transit")
+    args = parser.parse_args()
+
+    esp32 = FakeESP32(args.baud, args.drop, args.corrupt, verbose=True, byte_loss_rate=args.lose_byte).start()
+    print(f"🔌 Fake ESP32 on {esp32.path} ({args.baud} baud)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        esp32.stop()
+        print(f"🔌 Fake ESP32 stopped: {esp32.received} frames, {esp32.dropped} dropped, {esp32.corrupted} corrupted, "
+              f"{esp32.lost_bytes} bytes lost")
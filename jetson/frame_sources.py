@@ -0,0 +1,271 @@
+"""where the pipeline's frames come from
+
+open_frame_source picks a source from a spec:
+- a camera index ("0") or device path (/dev/video0): live camera, drained
+  by a grabber thread that keeps only the newest frame
+- a GStreamer pipeline ending in an appsink (see gst_capture.py): live camera
+- a video file: played back from its own timestamps
+- a directory of images: played back at --replay-fps in name order
+- a recorded session directory (see session_log.py): played back from its
+  recorded capture times, with its detections available to ReplayPredictor
+
+file sources play either in real time or as fast as the pipeline takes
+frames (realtime=False), for benchmarks and deterministic regression runs.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from gst_capture import is_pipeline
+from session_log import SessionReader, table_path
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class FrameSource:
+    """
+    read() returns (frame, timestamp, frame_index) or None at the end of the
+    source. Timestamps are seconds on the source's own clock: monotonic time
+    for a camera, media time for files. Runs on the capture thread.
+    """
+    live = False  # live sources are paced by the frame scheduler, not by their timestamps
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.index = 0
+        self.clock_start = None  # (wall time, media time) of the first frame
+        self.ring = None  # FrameRing to decode into, set by the pipeline
+        self.frame_shape = None
+
+    def buffer(self):
+        """Preallocated buffer for the next frame, once the frame size is known."""
+        if self.ring is None or self.frame_shape is None:
+            return None
+        return self.ring.take(self.frame_shape)
+
+    def read_capture(self, capture):
+        """VideoCapture.read into a reused buffer when one is available."""
+        success, frame = capture.read(self.buffer())
+        if success:
+            self.frame_shape = frame.shape
+        return success, frame
+
+    def pace(self, timestamp):
+        """In real-time playback, wait until this frame is due."""
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        if self.clock_start is None:
+            self.clock_start = (now, timestamp)
+            return
+        delay = self.clock_start[0] + (timestamp - self.clock_start[1]) - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def next_frame(self):
+        raise NotImplementedError
+
+    def read(self):
+        item = self.next_frame()
+        if item is None:
+            return None
+        frame, timestamp = item
+        self.pace(timestamp)
+        index = self.index
+        self.index += 1
+        return frame, timestamp, index
+
+    def release(self):
+        pass
+
+    def stats(self):
+        return {"frames": self.index}
+
+
+class CameraSource(FrameSource):
+    """
+    A live camera. The driver queues several frames (V4L2 typically 4), so
+    reading only when the pipeline is ready returns frames that waited in
+    that queue. With grab=True a grabber thread drains the camera at its own
+    rate into a few private buffers and keeps just the newest frame; read()
+    copies that one into the pipeline's ring and older ones are discarded.
+    device may also be an already opened VideoCapture.
+    """
+    live = True
+    GRAB_BUFFERS = 3  # the grabber never writes into the buffer that holds the newest frame
+
+    def __init__(self, device, width=None, height=None, grab=True):
+        super().__init__(realtime=True)
+        self.camera = device if hasattr(device, "read") else cv2.VideoCapture(device)
+        if width and height:
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.grab = grab
+        self.condition = threading.Condition()
+        self.latest = None  # (frame, timestamp, grab number) of the newest frame
+        self.delivered = 0  # grab number of the last frame read() returned
+        self.grabbed = 0
+        self.discarded = 0  # frames replaced by a newer one before read() took them
+        self.failed = False
+        self.stopped = False
+        self.thread = None
+
+    def frame_time(self):
+        """Capture time on the monotonic clock: the driver's buffer timestamp where
+        the backend reports one (V4L2 stamps buffers with CLOCK_MONOTONIC), else now."""
+        now = time.monotonic()
+        stamp = self.camera.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return stamp if 0 < now - stamp < 1.0 else now
+
+    def grab_frames(self):
+        buffers = [None] * self.GRAB_BUFFERS
+        slot = 0
+        while not self.stopped:
+            success, frame = self.camera.read(buffers[slot])
+            timestamp = self.frame_time()
+            with self.condition:
+                if not success:
+                    self.failed = True
+                    self.condition.notify_all()
+                    return
+                if self.latest is not None and self.latest[2] > self.delivered:
+                    self.discarded += 1
+                self.grabbed += 1
+                self.latest = (frame, timestamp, self.grabbed)
+                self.condition.notify_all()
+            buffers[slot] = frame
+            slot = (slot + 1) % len(buffers)
+
+    def next_frame(self):
+        if not self.grab:
+            success, frame = self.read_capture(self.camera)
+            if not success:
+                print("❌ Camera read failed, stopping stream")
+                return None
+            return frame, self.frame_time()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.grab_frames, name="grabber", daemon=True)
+            self.thread.start()
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.stopped or self.failed or (self.latest is not None and self.latest[2] > self.delivered)
+            )
+            if self.latest is None or self.latest[2] <= self.delivered:
+                if self.failed:
+                    print("❌ Camera read failed, stopping stream")
+                return None
+            frame, timestamp, self.delivered = self.latest
+            # Copied under the lock, so the grabber cannot be reusing this buffer meanwhile
+            self.frame_shape = frame.shape
+            out = self.buffer()
+            if out is None:
+                return frame.copy(), timestamp
+            np.copyto(out, frame)
+            return out, timestamp
+
+    def pace(self, timestamp):
+        pass
+
+    def release(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        self.camera.release()
+
+    def stats(self):
+        return {"frames": self.index, "grabbed": self.grabbed, "discarded": self.discarded, "grabber": self.grab}
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, realtime=True):
+        super().__init__(realtime)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise FileNotFoundError(f"Could not open video {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def next_frame(self):
+        success, frame = self.read_capture(self.capture)
+        if not success:
+            return None
+        # Frame number over nominal fps is exact and monotonic; CAP_PROP_POS_MSEC is not always either
+        return frame, self.index / self.fps
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, path, fps=30.0, realtime=True):
+        super().__init__(realtime)
+        self.fps = fps
+        self.paths = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.paths:
+            raise FileNotFoundError(f"No images in {path}")
+
+    def next_frame(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            if frame is not None:
+                return frame, self.index / self.fps
+            print(f"⚠️ Skipping unreadable image {self.paths[self.index]}")
+            self.index += 1
+        return None
+
+
+class SessionSource(FrameSource):
+    """Frames of a recorded session, with their recorded frame numbers and capture times."""
+    def __init__(self, path, realtime=True):
+        super().__init__(realtime)
+        self.session = SessionReader(path)
+
+    def next_frame(self):
+        if self.index >= len(self.session):
+            return None
+        frame = cv2.imdecode(np.frombuffer(self.session.jpeg(self.index), dtype=np.uint8), cv2.IMREAD_COLOR)
+        return frame, float(self.session.times[self.index])
+
+    def read(self):
+        item = super().read()
+        if item is None:
+            return None
+        frame, timestamp, i = item
+        # Keep the recorded frame number so replayed detections line up
+        return frame, timestamp, int(self.session.frame_numbers[i])
+
+    def release(self):
+        self.session.close()
+
+
+def is_session(path):
+    return os.path.isdir(path) and os.path.exists(table_path(path, "frames"))
+
+
+def open_frame_source(spec, width=None, height=None, realtime=True, fps=30.0, grab=True):
+    """Frame source for a camera index/device, video file, image directory or recorded session.
+    grab=False reads cameras directly instead of through the grabber thread."""
+    if is_pipeline(spec):
+        # The pipeline sets the size itself
+        capture = cv2.VideoCapture(spec, cv2.CAP_GSTREAMER)
+        if not capture.isOpened():
+            raise RuntimeError(f"Could not open GStreamer pipeline: {spec}")
+        return CameraSource(capture, grab=grab)
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec), width, height, grab)
+    if str(spec).startswith("/dev/video"):
+        return CameraSource(spec, width, height, grab)
+    if is_session(spec):
+        return SessionSource(spec, realtime)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, fps, realtime)
+    return VideoFileSource(spec, realtime)
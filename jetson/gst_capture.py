@@ -0,0 +1,120 @@
+"""GStreamer capture pipelines for cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+
+- nvargus: CSI camera through nvarguscamerasrc. Frames stay in NVMM memory
+  until nvvidconv (the VIC) has resized them and converted NV12 to BGRx;
+  only the final BGRx -> BGR channel drop runs on the CPU.
+- v4l2: USB/V4L2 camera. On a Jetson nvvidconv does the resize/convert
+  (and nvv4l2decoder the MJPEG decode); elsewhere videoscale/videoconvert
+  do it in software, so the same option works on a dev box.
+- file: anything decodebin plays, scaled to the output size.
+
+every pipeline ends in an appsink that keeps only the newest buffer, so
+nothing queues up behind a slow reader. needs an OpenCV built with
+GStreamer (the JetPack one is); capture_pipeline returns None otherwise.
+
+python3 gst_capture.py nvargus 0 --size 640x480   # print a pipeline, e.g. to try with gst-launch-1.0
+"""
+
+import argparse
+import os
+
+import cv2
+
+BACKENDS = ("gstreamer", "nvargus")
+NVARGUS_CAPTURE_SIZE = (1280, 720)  # sensor mode to capture at before the hardware resize
+
+
+def gstreamer_available():
+    """Whether this OpenCV build can open GStreamer pipelines."""
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("GStreamer:"):
+            return "YES" in line
+    return False
+
+
+def is_jetson():
+    return os.path.exists("/etc/nv_tegra_release")
+
+
+def appsink(sync=False):
+    """sync=True plays at the stream's own rate (files); live sources run free."""
+    return f"appsink drop=true max-buffers=1 sync={str(sync).lower()}"
+
+
+def nvargus_pipeline(sensor_id=0, width=640, height=480, fps=30, capture_size=NVARGUS_CAPTURE_SIZE, flip=0):
+    capture_width, capture_height = capture_size
+    return " ! ".join([
+        f"nvarguscamerasrc sensor-id={sensor_id}",
+        f"video/x-raw(memory:NVMM),width={capture_width},height={capture_height},framerate={int(fps)}/1,format=NV12",
+        f"nvvidconv flip-method={flip}",
+        f"video/x-raw,width={width},height={height},format=BGRx",
+        "videoconvert",
+        "video/x-raw,format=BGR",
+        appsink()
+    ])
+
+
+def v4l2_pipeline(device="/dev/video0", width=640, height=480, fps=30, hardware=None, mjpeg=False):
+    """hardware defaults to whether this is a Jetson. mjpeg reads the camera's
+    MJPEG mode, which most USB cameras need for full frame rate at 720p and up."""
+    hardware = is_jetson() if hardware is None else hardware
+    elements = [f"v4l2src device={device}"]
+    if mjpeg:
+        elements += [f"image/jpeg,framerate={int(fps)}/1", "nvv4l2decoder mjpeg=1" if hardware else "jpegdec"]
+    else:
+        elements.append(f"video/x-raw,framerate={int(fps)}/1")
+    if hardware:
+        elements += ["nvvidconv", f"video/x-raw,width={width},height={height},format=BGRx",
+                     "videoconvert", "video/x-raw,format=BGR"]
+    else:
+        elements += ["videoconvert", "videoscale", f"video/x-raw,width={width},height={height},format=BGR"]
+    elements.append(appsink())
+    return " ! ".join(elements)
+
+
+def file_pipeline(path, width=640, height=480):
+    return " ! ".join([
+        f'filesrc location="{path}"',
+        "decodebin",
+        "videoconvert",
+        "videoscale",
+        f"video/x-raw,width={width},height={height},format=BGR",
+        appsink(sync=True)
+    ])
+
+
+def build_pipeline(backend, device, width=640, height=480, fps=30):
+    """GStreamer pipeline for a --camera device under a --capture-backend. device
+    is a camera index, a /dev/video path or a file; nvargus takes the index
+    as the sensor id."""
+    if backend == "nvargus":
+        return nvargus_pipeline(int(device), width, height, fps)
+    if isinstance(device, int) or str(device).isdigit():
+        return v4l2_pipeline(f"/dev/video{device}", width, height, fps)
+    if str(device).startswith("/dev/video"):
+        return v4l2_pipeline(device, width, height, fps)
+    return file_pipeline(device, width, height)
+
+
+def capture_pipeline(backend, device, width=640, height=480, fps=30):
+    """build_pipeline, or None if this OpenCV cannot open GStreamer pipelines."""
+    if not gstreamer_available():
+        return None
+    return build_pipeline(backend, device, width, height, fps)
+
+
+def is_pipeline(spec):
+    return isinstance(spec, str) and "!" in spec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backend", choices=BACKENDS)
+    parser.add_argument("device", nargs="?", default="0")
+    parser.add_argument("--size", type=str, default="640x480")
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args()
+    width, height = map(int, args.size.split("x"))
+    if not gstreamer_available():
+        print("# this OpenCV was built without GStreamer; the server will fall back to the OpenCV backend")
+    print(build_pipeline(args.backend, args.device, width, height, args.fps))
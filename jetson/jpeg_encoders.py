@@ -0,0 +1,105 @@
+"""JPEG encoders for the MJPEG stream
+
+every backend takes a BGR uint8 frame and returns JPEG bytes, at its own
+mutable quality or one passed per call. opencv is always available; the
+others are used when their package is installed:
+- simplejpeg   pip install simplejpeg   (libjpeg-turbo, releases the GIL)
+- turbojpeg    pip install PyTurboJPEG  (needs the libturbojpeg shared library)
+- nvjpeg       pip install pynvjpeg     (GPU/Jetson hardware encoder; shares
+               the GPU with inference, so it is never picked automatically)
+"""
+
+import cv2
+
+# Tried in order by "auto"
+AUTO_ORDER = ("simplejpeg", "turbojpeg", "opencv")
+
+
+class JpegEncoder:
+    name = None
+
+    def __init__(self, quality=50):
+        self.quality = quality
+
+    def encode(self, frame, quality=None):
+        raise NotImplementedError
+
+    def resolve(self, quality):
+        return int(self.quality if quality is None else quality)
+
+
+class OpenCVEncoder(JpegEncoder):
+    name = "opencv"
+
+    def encode(self, frame, quality=None):
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.resolve(quality)])
+        return buffer.tobytes()
+
+
+class SimpleJpegEncoder(JpegEncoder):
+    name = "simplejpeg"
+
+    def __init__(self, quality=50):
+        super().__init__(quality)
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+
+    def encode(self, frame, quality=None):
+        return self.simplejpeg.encode_jpeg(
+            frame, quality=self.resolve(quality), colorspace="BGR", colorsubsampling="420", fastdct=True
+        )
+
+
+class TurboJpegEncoder(JpegEncoder):
+    name = "turbojpeg"
+
+    def __init__(self, quality=50):
+        super().__init__(quality)
+        from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+        self.turbojpeg = TurboJPEG()
+        self.pixel_format = TJPF_BGR
+        self.subsample = TJSAMP_420
+
+    def encode(self, frame, quality=None):
+        return self.turbojpeg.encode(
+            frame, quality=self.resolve(quality), pixel_format=self.pixel_format, jpeg_subsample=self.subsample
+        )
+
+
+class NvJpegEncoder(JpegEncoder):
+    name = "nvjpeg"
+
+    def __init__(self, quality=50):
+        super().__init__(quality)
+        from nvjpeg import NvJpeg
+        self.nvjpeg = NvJpeg()
+
+    def encode(self, frame, quality=None):
+        return self.nvjpeg.encode(frame, self.resolve(quality))
+
+
+ENCODERS = {cls.name: cls for cls in (OpenCVEncoder, SimpleJpegEncoder, TurboJpegEncoder, NvJpegEncoder)}
+
+
+def available_encoders():
+    """Names of the backends that can be constructed here."""
+    names = []
+    for name, cls in ENCODERS.items():
+        try:
+            cls()
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def make_encoder(name="auto", quality=50):
+    """Encoder by name, or the fastest available CPU backend for "auto"."""
+    if name != "auto":
+        return ENCODERS[name](quality)
+    for candidate in AUTO_ORDER:
+        try:
+            return ENCODERS[candidate](quality)
+        except Exception:
+            continue
+    return OpenCVEncoder(quality)
@@ -0,0 +1,96 @@
+"""stand-in for TreePredictor that replays a recorded session's detections
+
+lets the server, benchmarks and regression runs exercise merge, tracking
+and autonomous control on a machine with no GPU or TensorRT engine. text
+encoders return placeholder embeddings, so prompts still parse and cache.
+"""
+
+import bisect
+import time
+
+import numpy as np
+import torch
+from nanoowl.tree_predictor import TreeDetection, TreeOutput
+from nanoowl.owl_predictor import OwlEncodeTextOutput
+from nanoowl.clip_predictor import ClipEncodeTextOutput
+
+from session_log import SessionReader
+
+
+class StubTextEncoder:
+    """Encodes any labels to zero embeddings, on the CPU."""
+    device = "cpu"
+
+    def __init__(self, output_type, dim=512):
+        self.output_type = output_type
+        self.dim = dim
+
+    def encode_text(self, labels):
+        return self.output_type(text_embeds=torch.zeros(len(labels), self.dim))
+
+
+class ReplayPredictor:
+    """
+    predict() returns the detections recorded for the given frame number,
+    or for the latest recorded frame before it (the recording may have run
+    the detector on fewer frames than it captured). Recorded label text is
+    mapped onto the current prompt's labels; detections whose labels are
+    not in the prompt are dropped. latency adds a sleep per call to stand
+    in for GPU time. Recorded boxes are in camera frame coordinates; for an
+    image cropped and resized from the frame, to_frame gives the (scale,
+    offset) from image to frame, and boxes are mapped into the image and
+    clipped to it, so objects outside it go undetected.
+    """
+    def __init__(self, session_path, latency=0.0):
+        session = SessionReader(session_path)
+        self.detections = session.detections()
+        session.close()
+        self.frames = sorted(self.detections)
+        self.latency = latency
+        self.clip_predictor = StubTextEncoder(ClipEncodeTextOutput)
+        self.owl_predictor = StubTextEncoder(OwlEncodeTextOutput)
+
+    def recorded_frame(self, frame_index):
+        i = bisect.bisect_right(self.frames, frame_index)
+        return self.frames[i - 1] if i else None
+
+    def predict(self, image, tree, threshold=0.1, clip_text_encodings=None, owl_text_encodings=None,
+                frame_index=None, to_frame=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.replay(image, frame_index, to_frame, tree)
+
+    def recorded_boxes(self, image, frame_index, to_frame):
+        """This frame's recorded non-root detections, with boxes in image coordinates."""
+        recorded = [row for row in self.detections.get(self.recorded_frame(frame_index), []) if row[0] != 0]
+        if to_frame is None or not recorded:
+            return recorded
+        scale, offset = to_frame
+        boxes = (np.array([row[2] for row in recorded], dtype=np.float64) - offset) / scale
+        boxes = np.clip(boxes, 0, [image.width, image.height, image.width, image.height])
+        visible = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+        return [
+            (det_id, parent_id, box, labels, scores)
+            for (det_id, parent_id, _, labels, scores), box, keep in zip(recorded, boxes.tolist(), visible.tolist())
+            if keep
+        ]
+
+    def replay(self, image, frame_index, to_frame, tree):
+        label_indices = {label: i for i, label in enumerate(tree.labels)}
+        root = TreeDetection(id=0, parent_id=-1, box=(0., 0., float(image.width), float(image.height)), labels=[0], scores=[1.])
+        detections = [root]
+
+        if frame_index is None:
+            return TreeOutput(detections=detections)
+        for det_id, parent_id, box, labels, scores in self.recorded_boxes(image, frame_index, to_frame):
+            kept = [(label_indices[label], score) for label, score in zip(labels, scores) if label in label_indices]
+            if not kept:
+                continue
+            detections.append(TreeDetection(
+                id=det_id,
+                parent_id=parent_id,
+                box=tuple(box),
+                labels=[label for label, _ in kept],
+                scores=[score for _, score in kept]
+            ))
+        return TreeOutput(detections=detections)
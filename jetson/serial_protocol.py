@@ -0,0 +1,119 @@
+"""binary framed protocol between the Jetson and the ESP32 motor controller
+
+must stay in sync with treehacks_rc_car/src/main.cpp
+
+command frame (Jetson -> ESP32), 5 bytes:
+    0xA5 | seq | opcode | speed | crc8(seq, opcode, speed)
+
+ack frame (ESP32 -> Jetson), 6 bytes, one per command frame received:
+    0x5A | seq | status | opcode | rx_errors | crc8(seq, status, opcode, rx_errors)
+
+seq is a wrapping 8-bit counter chosen by the sender and echoed in the ack,
+speed is the PWM duty (0-255) for both motors, and rx_errors is the
+ESP32's wrapping count of frames it has rejected, as telemetry.
+
+the link itself is any pyserial-style object (write, read, in_waiting,
+close); open_transport picks one from a device path or pyserial URL, so the
+same sender runs against the Jetson UART, a pty from fake_esp32.py, or a
+socket:// bridge.
+"""
+
+from collections import namedtuple
+
+import serial
+
+COMMAND_SYNC = 0xA5
+ACK_SYNC = 0x5A
+COMMAND_FRAME_SIZE = 5
+ACK_FRAME_SIZE = 6
+
+# Opcodes
+OP_STOP = 0x00
+OP_FORWARD = 0x01
+OP_BACKWARD = 0x02
+OP_TURN_LEFT = 0x03
+OP_TURN_RIGHT = 0x04
+
+# Ack status codes
+STATUS_OK = 0x00
+STATUS_BAD_CHECKSUM = 0x01
+STATUS_BAD_OPCODE = 0x02
+
+SERIAL_DEVICE = "/dev/ttyTHS1"  # Jetson UART wired to the ESP32
+BAUD_RATE = 115200
+
+CommandFrame = namedtuple("CommandFrame", ["seq", "opcode", "speed"])
+AckFrame = namedtuple("AckFrame", ["seq", "status", "opcode", "rx_errors"])
+
+
+def crc8(data):
+    """CRC-8, polynomial 0x07, init 0x00."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_command(seq, opcode, speed):
+    body = bytes([seq & 0xFF, opcode, speed])
+    return bytes([COMMAND_SYNC]) + body + bytes([crc8(body)])
+
+
+def encode_ack(seq, status, opcode, rx_errors):
+    body = bytes([seq & 0xFF, status, opcode, rx_errors & 0xFF])
+    return bytes([ACK_SYNC]) + body + bytes([crc8(body)])
+
+
+class FrameParser:
+    """
+    Incremental parser for one direction of the protocol. Bytes can arrive in
+    any chunking; anything before a sync byte is skipped, and a frame with a
+    bad checksum is dropped and parsing resumes at the next sync byte.
+    """
+    def __init__(self, sync, frame_size, frame_type):
+        self.sync = sync
+        self.frame_size = frame_size
+        self.frame_type = frame_type
+        self.buffer = bytearray()
+        self.bad_frames = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """Add received bytes and return the frames they complete."""
+        self.buffer.extend(data)
+        frames = []
+        while True:
+            start = self.buffer.find(self.sync)
+            if start < 0:
+                self.skipped_bytes += len(self.buffer)
+                self.buffer.clear()
+                return frames
+            if start:
+                self.skipped_bytes += start
+                del self.buffer[:start]
+            if len(self.buffer) < self.frame_size:
+                return frames
+
+            body = bytes(self.buffer[1:self.frame_size - 1])
+            if crc8(body) == self.buffer[self.frame_size - 1]:
+                frames.append(self.frame_type(*body))
+                del self.buffer[:self.frame_size]
+            else:
+                self.bad_frames += 1
+                del self.buffer[:1]
+
+
+def command_parser():
+    return FrameParser(COMMAND_SYNC, COMMAND_FRAME_SIZE, CommandFrame)
+
+
+def ack_parser():
+    return FrameParser(ACK_SYNC, ACK_FRAME_SIZE, AckFrame)
+
+
+def open_transport(spec=SERIAL_DEVICE, baudrate=BAUD_RATE, timeout=0.1):
+    """Open the command link: a device path (/dev/ttyTHS1, /dev/pts/N) or a
+    pyserial URL (socket://host:port, rfc2217://..., loop://)."""
+    return serial.serial_for_url(spec, baudrate=baudrate, timeout=timeout)
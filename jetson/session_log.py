@@ -0,0 +1,285 @@
+"""on-disk layout of a recorded session, and readers/writers for it
+
+a session is a directory of append-only files:
+- frames.jpg        JPEG frames back to back
+- frames.arrow      frame, t, offset, size            (where each JPEG lives)
+- detections.arrow  frame, t, id, parent_id, x0, y0, x1, y1, labels, scores
+- tracks.arrow      frame, t, track_id, x0, y0, x1, y1, labels, scores
+- commands.arrow    t, frame, command, seq
+
+detections are the detector's raw output (before merging) for the frames
+it ran on; tracks are the valid tracks drawn on every streamed frame;
+commands are motor commands as they were written to the ESP32, with their
+protocol sequence number (commands superseded before they were sent are
+not logged), tagged with the latest streamed frame. tables are Arrow IPC
+streams written in small batches, so a session cut short by a crash is
+readable up to its last complete batch. t is the capture time in seconds
+on the server's monotonic clock, and labels are stored as text so a
+session can be replayed under a different prompt.
+"""
+
+import mmap
+import os
+import queue
+import threading
+import time
+
+try:
+    import pyarrow as pa
+except ImportError:  # only needed to record or replay sessions
+    pa = None
+
+FRAMES_FILE = "frames.jpg"
+
+SCHEMAS = {
+    "frames": [("frame", "int64"), ("t", "float64"), ("offset", "int64"), ("size", "int64")],
+    "detections": [
+        ("frame", "int64"), ("t", "float64"), ("id", "int32"), ("parent_id", "int32"),
+        ("x0", "float32"), ("y0", "float32"), ("x1", "float32"), ("y1", "float32"),
+        ("labels", "list<string>"), ("scores", "list<float32>")
+    ],
+    "tracks": [
+        ("frame", "int64"), ("t", "float64"), ("track_id", "int64"),
+        ("x0", "float32"), ("y0", "float32"), ("x1", "float32"), ("y1", "float32"),
+        ("labels", "list<string>"), ("scores", "list<float32>")
+    ],
+    "commands": [("t", "float64"), ("frame", "int64"), ("command", "string"), ("seq", "int32")]
+}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required to record or replay sessions (pip install pyarrow)")
+
+
+def arrow_schema(columns):
+    types = {
+        "int32": pa.int32(), "int64": pa.int64(), "float32": pa.float32(), "float64": pa.float64(),
+        "string": pa.string(), "list<string>": pa.list_(pa.string()), "list<float32>": pa.list_(pa.float32())
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def table_path(root, name):
+    return os.path.join(root, f"{name}.arrow")
+
+
+class TableWriter:
+    """Buffers rows column-wise and appends them to an Arrow IPC stream in batches."""
+    def __init__(self, path, columns, batch_rows=256):
+        self.schema = arrow_schema(columns)
+        self.names = [name for name, _ in columns]
+        self.columns = {name: [] for name in self.names}
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def append(self, row):
+        for name, value in zip(self.names, row):
+            self.columns[name].append(value)
+        self.rows += 1
+        if len(self.columns[self.names[0]]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.columns[self.names[0]]:
+            return
+        batch = pa.record_batch([self.columns[name] for name in self.names], schema=self.schema)
+        self.writer.write_batch(batch)
+        self.columns = {name: [] for name in self.names}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.sink.close()
+
+
+class SessionWriter:
+    """Appends frames and per-frame detections to a session directory. Not thread-safe."""
+    def __init__(self, root, tables=SCHEMAS, batch_rows=256):
+        require_pyarrow()
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.frames_file = open(os.path.join(root, FRAMES_FILE), "wb")
+        self.offset = 0
+        self.tables = {name: TableWriter(table_path(root, name), columns, batch_rows) for name, columns in tables.items()}
+
+    def write_frame(self, frame, t, jpeg):
+        self.frames_file.write(jpeg)
+        self.tables["frames"].append((frame, t, self.offset, len(jpeg)))
+        self.offset += len(jpeg)
+
+    def write_detections(self, frame, t, rows):
+        """rows from detection_rows()."""
+        for det_id, parent_id, box, labels, scores in rows:
+            self.tables["detections"].append((frame, t, det_id, parent_id, *box, labels, scores))
+
+    def write_tracks(self, frame, t, rows):
+        """rows from track_rows()."""
+        for track_id, box, labels, scores in rows:
+            self.tables["tracks"].append((frame, t, track_id, *box, labels, scores))
+
+    def write_command(self, t, frame, command, seq):
+        self.tables["commands"].append((t, frame, command, seq))
+
+    def flush(self):
+        for table in self.tables.values():
+            table.flush()
+        self.frames_file.flush()
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.frames_file.close()
+
+
+def detection_rows(detections, label_map):
+    """Plain-value copy of TreeDetections, safe to hand to another thread."""
+    return [
+        (d.id, d.parent_id, tuple(map(float, d.box)),
+         [label_map[label] for label in d.labels], [float(score) for score in d.scores])
+        for d in detections
+    ]
+
+
+def track_rows(tracked_boxes):
+    """Plain-value copy of TrackedBox snapshots."""
+    return [
+        (box.track_id, tuple(map(float, box.box)), list(box.labels), [float(score) for score in box.scores])
+        for box in tracked_boxes
+    ]
+
+
+class SessionRecorder:
+    """
+    Records a session from a background thread. The record_* calls only copy
+    plain values onto a bounded queue and never block: if the writer falls
+    behind, new records are dropped and counted rather than stalling the
+    stream. The writer flushes its tables whenever the queue goes idle, so a
+    crash loses at most the last moment of the session.
+    """
+    def __init__(self, root, queue_size=256, flush_interval=1.0):
+        self.root = root
+        self.writer = SessionWriter(root)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.flush_interval = flush_interval
+        self.last_frame = -1
+        self.recorded = 0
+        self.dropped = 0
+        self.write_time = 0.0
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_frame(self, frame, t, jpeg):
+        self.last_frame = frame
+        self.put(("frame", frame, t, jpeg))
+
+    def record_detections(self, frame, t, detections, label_map):
+        self.put(("detections", frame, t, detection_rows(detections, label_map)))
+
+    def record_tracks(self, frame, t, tracked_boxes):
+        self.put(("tracks", frame, t, track_rows(tracked_boxes)))
+
+    def record_command(self, command, seq):
+        self.put(("command", time.monotonic(), self.last_frame, command, seq))
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.writer.flush()
+                continue
+            if record is None:
+                break
+            start = time.perf_counter()
+            kind, *args = record
+            getattr(self.writer, f"write_{kind}")(*args)
+            self.write_time += time.perf_counter() - start
+            self.recorded += 1
+        self.writer.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {
+            "path": self.root,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "frame_bytes": self.writer.offset,
+            "write_ms": round(self.write_time * 1000, 1)
+        }
+
+
+def read_table(root, name):
+    """Read one table, keeping every complete batch of a truncated stream."""
+    require_pyarrow()
+    path = table_path(root, name)
+    if not os.path.exists(path):
+        return None
+    batches = []
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_stream(source)
+        except pa.ArrowInvalid:
+            return None
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+class SessionReader:
+    """Random access to a session's frames (memory-mapped JPEGs) and recorded detections."""
+    def __init__(self, root):
+        self.root = root
+        frames = read_table(root, "frames")
+        if frames is None:
+            raise FileNotFoundError(f"{root} is not a recorded session (no {table_path(root, 'frames')})")
+        self.frame_numbers = frames.column("frame").to_numpy()
+        self.times = frames.column("t").to_numpy()
+        self.offsets = frames.column("offset").to_numpy()
+        self.sizes = frames.column("size").to_numpy()
+
+        frames_path = os.path.join(root, FRAMES_FILE)
+        self.frames_file = open(frames_path, "rb")
+        self.frames_map = mmap.mmap(self.frames_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(frames_path) else b""
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def jpeg(self, i):
+        """JPEG bytes of the i-th recorded frame."""
+        offset = int(self.offsets[i])
+        return self.frames_map[offset:offset + int(self.sizes[i])]
+
+    def detections(self):
+        """frame number -> list of (id, parent_id, box, label texts, scores), in recorded order."""
+        table = read_table(self.root, "detections")
+        by_frame = {}
+        if table is None:
+            return by_frame
+        columns = table.to_pydict()
+        for i, frame in enumerate(columns["frame"]):
+            box = (columns["x0"][i], columns["y0"][i], columns["x1"][i], columns["y1"][i])
+            by_frame.setdefault(frame, []).append(
+                (columns["id"][i], columns["parent_id"][i], box, columns["labels"][i], columns["scores"][i])
+            )
+        return by_frame
+
+    def close(self):
+        if isinstance(self.frames_map, mmap.mmap):
+            self.frames_map.close()
+        self.frames_file.close()
@@ -0,0 +1,48 @@
+"""crash recovery of text_embedding_store.TextEmbeddingStore
+
+python3 -m pytest test_text_embedding_store.py
+"""
+
+import json
+
+import numpy as np
+
+from text_embedding_store import TextEmbeddingStore
+
+
+def rows(value, count=1, dim=4):
+    return np.full((count, dim), value, dtype=np.float32)
+
+
+def test_reopen_after_crash_before_index_write(tmp_path):
+    store = TextEmbeddingStore(str(tmp_path), "owl:test")
+    store.put_many(["a face"], rows(1))
+
+    # Crash after the data append, before the index write: an unindexed row
+    with open(store.data_path, "ab") as f:
+        f.write(rows(9).tobytes())
+
+    store = TextEmbeddingStore(str(tmp_path), "owl:test")
+    store.put_many(["a bottle"], rows(2))
+    found, embeds = store.get_many(["a face", "a bottle"])
+    assert found == ["a face", "a bottle"]
+    np.testing.assert_array_equal(embeds, np.concatenate([rows(1), rows(2)]))
+
+    store = TextEmbeddingStore(str(tmp_path), "owl:test")
+    np.testing.assert_array_equal(store.get_many(["a bottle"])[1], rows(2))
+
+
+def test_reopen_with_index_past_data(tmp_path):
+    store = TextEmbeddingStore(str(tmp_path), "owl:test")
+    store.put_many(["a face", "a hand"], rows(1, count=2))
+
+    # Data cut short (e.g. a torn append on power loss) under an index that counts it
+    with open(store.data_path, "r+b") as f:
+        f.truncate(rows(1).nbytes + 3)
+    with open(store.index_path) as f:
+        assert json.load(f)["rows"] == {"a face": 0, "a hand": 1}
+
+    store = TextEmbeddingStore(str(tmp_path), "owl:test")
+    assert "a face" in store and "a hand" not in store
+    store.put_many(["a hand"], rows(3))
+    np.testing.assert_array_equal(store.get_many(["a face", "a hand"])[1], np.concatenate([rows(1), rows(3)]))
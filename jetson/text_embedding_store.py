@@ -0,0 +1,160 @@
+"""on-disk store of CLIP/OWL text embeddings, memory-mapped for lookup
+
+embeddings are keyed by label text, in one directory per model identity
+(model name + image encoder engine), so a warm start or a prompt switch is
+a file lookup instead of a text-encoder run. rows are only ever appended.
+
+pre-populate from a file with one prompt per line:
+python3 text_embedding_store.py ../../data/owl_image_encoder_patch32.engine --prompts prompts.txt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+OWL_MODEL_NAME = "google/owlvit-base-patch32"  # nanoowl OwlPredictor default
+CLIP_MODEL_NAME = "ViT-B/32"  # nanoowl ClipPredictor default
+DEFAULT_STORE_DIR = "text_embeddings"
+
+
+def model_identity(kind, model_name, engine_path=None):
+    """Identity string for a text encoder. Includes the engine file's name, size
+    and mtime so a rebuilt engine never reuses embeddings from an old one."""
+    identity = f"{kind}:{model_name}"
+    if engine_path:
+        stat = os.stat(engine_path)
+        identity += f":{os.path.basename(engine_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    return identity
+
+
+class TextEmbeddingStore:
+    """
+    Append-only embedding table for one model identity. Rows live in a raw
+    binary file that is memory-mapped for reads; index.json maps label text to
+    row number and records dtype and width.
+    """
+    def __init__(self, root, identity):
+        self.identity = identity
+        self.path = os.path.join(root, hashlib.sha1(identity.encode()).hexdigest()[:16])
+        self.index_path = os.path.join(self.path, "index.json")
+        self.data_path = os.path.join(self.path, "embeds.bin")
+        os.makedirs(self.path, exist_ok=True)
+
+        self.rows = {}
+        self.dtype = None
+        self.dim = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.rows = index["rows"]
+            self.dtype = np.dtype(index["dtype"])
+            self.dim = index["dim"]
+            self.repair()
+        self.embeds = None
+        self.remap()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, label):
+        return label in self.rows
+
+    def repair(self):
+        """Make embeds.bin hold exactly the indexed rows. A crash between the data
+        append and the index write leaves unindexed rows at the end, which the
+        next append would otherwise be numbered after; cut them off. Labels the
+        data does not reach are dropped, to be encoded again."""
+        row_bytes = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        stored = size // row_bytes
+        self.rows = {label: row for label, row in self.rows.items() if row < stored}
+        if size != len(self.rows) * row_bytes:
+            with open(self.data_path, "r+b") as f:
+                f.truncate(len(self.rows) * row_bytes)
+
+    def remap(self):
+        if self.rows:
+            self.embeds = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(len(self.rows), self.dim))
+
+    def get_many(self, labels):
+        """(found labels, stacked embeddings) for the labels present in the store."""
+        found = [label for label in labels if label in self.rows]
+        if not found:
+            return [], None
+        return found, self.embeds[[self.rows[label] for label in found]]
+
+    def put_many(self, labels, embeds):
+        """Append embeddings (one row per label) for labels not yet stored."""
+        embeds = np.asarray(embeds).reshape(len(labels), -1)
+        if self.dtype is None:
+            self.dtype = embeds.dtype
+            self.dim = embeds.shape[1]
+        new = [i for i, label in enumerate(labels) if label not in self.rows]
+        if not new:
+            return
+
+        with open(self.data_path, "ab") as f:
+            f.write(np.ascontiguousarray(embeds[new], dtype=self.dtype).tobytes())
+        for i in new:
+            self.rows[labels[i]] = len(self.rows)
+
+        # Write the index last and atomically, so a crash never points past the
+        # data; rows appended but not indexed are cut off by repair() on reopen
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"identity": self.identity, "dtype": self.dtype.str, "dim": self.dim, "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+        self.remap()
+
+
+def open_stores(root, engine_path=None):
+    """CLIP and OWL stores for the server's predictor."""
+    return {
+        "clip": TextEmbeddingStore(root, model_identity("clip", CLIP_MODEL_NAME)),
+        "owl": TextEmbeddingStore(root, model_identity("owl", OWL_MODEL_NAME, engine_path))
+    }
+
+
+if __name__ == "__main__":
+    from nanoowl.tree import Tree
+    from nanoowl.tree_predictor import TreePredictor
+    from nanoowl.owl_predictor import OwlPredictor
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_encode_engine", type=str)
+    parser.add_argument("--prompts", type=str, required=True, help="File with one prompt per line")
+    parser.add_argument("--store", type=str, default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    predictor = TreePredictor(
+        owl_predictor=OwlPredictor(
+            image_encoder_engine=args.image_encode_engine
+        )
+    )
+    stores = open_stores(args.store, args.image_encode_engine)
+    encoders = {
+        "clip": predictor.clip_predictor.encode_text,
+        "owl": predictor.owl_predictor.encode_text
+    }
+
+    with open(args.prompts) as f:
+        prompts = [line.strip() for line in f if line.strip()]
+
+    for prompt in prompts:
+        tree = Tree.from_prompt(prompt)
+        label_indices = {
+            "clip": tree.get_classify_label_indices(),
+            "owl": tree.get_detect_label_indices()
+        }
+        for kind, indices in label_indices.items():
+            labels = list(dict.fromkeys(tree.labels[i] for i in indices))
+            missing = [label for label in labels if label not in stores[kind]]
+            if missing:
+                embeds = encoders[kind](missing).text_embeds.detach().cpu().numpy()
+                stores[kind].put_many(missing, embeds)
+                print(f"💾 {kind}: stored {', '.join(missing)}")
+
+    print(f"💾 Store {args.store}: {len(stores['clip'])} CLIP and {len(stores['owl'])} OWL labels")
@@ -18,13 +18,32 @@ from nanoowl.tree_predictor import (
     TreeOutput,
     TreeDetection
 )
-from nanoowl.owl_predictor import OwlPredictor
+from nanoowl.owl_predictor import OwlPredictor, OwlEncodeTextOutput
+from nanoowl.clip_predictor import ClipEncodeTextOutput
+import torch
 import numpy as np
 from typing import List
 from aiohttp.web import middleware
 from datetime import datetime
-import serial
 from enum import Enum, auto
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+from text_embedding_store import DEFAULT_STORE_DIR, open_stores
+import serial_protocol
+from frame_sources import open_frame_source
+from gst_capture import BACKENDS as GST_BACKENDS, capture_pipeline, is_pipeline
+from session_log import SessionRecorder
+from jpeg_encoders import ENCODERS, make_encoder
+import os
+import socket
+import math
+from replay_predictor import ReplayPredictor
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # fall back to greedy one-to-one matching
+    linear_sum_assignment = None
 
 def calculate_iou(box1, box2):
     """Calculate intersection over union between two bounding boxes."""
@@ -46,20 +65,35 @@ def calculate_iou(box1, box2):
     
     return intersection / union if union > 0 else 0.0
 
-def merge_overlapping_boxes(detections: List[TreeDetection], iou_threshold: float = 0.5) -> List[TreeDetection]:
-    """Merge overlapping bounding boxes with IoU above threshold."""
-    if not detections:
-        return detections
-        
-    filtered_detections = [d for d in detections if d.id != 0]
-    image_detections = [d for d in detections if d.id == 0]
+def box_iou(boxes_a, boxes_b):
+    """Element-wise IoU between two broadcastable arrays of x1, y1, x2, y2 boxes
+    (last axis of size 4). Matches calculate_iou value for value."""
+    x1_i = np.maximum(boxes_a[..., 0], boxes_b[..., 0])
+    y1_i = np.maximum(boxes_a[..., 1], boxes_b[..., 1])
+    x2_i = np.minimum(boxes_a[..., 2], boxes_b[..., 2])
+    y2_i = np.minimum(boxes_a[..., 3], boxes_b[..., 3])
     
-    if not filtered_detections:
-        return detections
-        
-    sorted_detections = sorted(filtered_detections, key=lambda x: x.scores[0], reverse=True)
-    merged_detections = []
+    intersection = (x2_i - x1_i) * (y2_i - y1_i)
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    union = area_a + area_b - intersection
     
+    overlapping = (x2_i >= x1_i) & (y2_i >= y1_i) & (union > 0)
+    return np.where(overlapping, intersection / np.where(overlapping, union, 1.0), 0.0)
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU between (N, 4) and (M, 4) box arrays, as an (N, M) array."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    return box_iou(boxes_a[:, None, :], boxes_b[None, :, :])
+
+# Below this many boxes the plain Python merge beats the NumPy one, whose
+# fixed per-call overhead only pays off once there are many pairs to compare
+MERGE_NUMPY_MIN_BOXES = 40
+
+def merge_sorted_boxes(sorted_detections, iou_threshold):
+    """Greedy merge of score-sorted detections, pairwise in plain Python."""
+    merged_detections = []
     while sorted_detections:
         current = sorted_detections.pop(0)
         to_merge = []
@@ -83,10 +117,78 @@ def merge_overlapping_boxes(detections: List[TreeDetection], iou_threshold: floa
             
             current.box = tuple(merged_box)
             current.scores = [total_score / (len(to_merge) + 1)]
-            
+        
         merged_detections.append(current)
+    return merged_detections
+
+def merge_sorted_boxes_numpy(sorted_detections, iou_threshold):
+    """
+    Same merge as merge_sorted_boxes, with all same-label IoUs computed in one
+    vectorized pass up front, which is exact because a box is only ever
+    compared while it still has its original coordinates.
+    """
+    boxes = np.array([d.box for d in sorted_detections], dtype=np.float64)
+    scores = np.array([d.scores[0] for d in sorted_detections], dtype=np.float64)
+    labels = np.array([d.labels[0] for d in sorted_detections])
+    count = len(sorted_detections)
     
-    return image_detections + merged_detections
+    # IoU is only needed for same-label pairs (i, j) with i before j in score order
+    pairs_i, pairs_j = np.nonzero(labels[:, None] == labels[None, :])
+    ordered = pairs_i < pairs_j
+    pairs_i, pairs_j = pairs_i[ordered], pairs_j[ordered]
+    mergeable = box_iou(boxes[pairs_i], boxes[pairs_j]) > iou_threshold
+    pairs_i, pairs_j = pairs_i[mergeable], pairs_j[mergeable]
+    
+    # Greedy grouping over the mergeable pairs, in score order: a box that has
+    # not been absorbed yet absorbs every later box that is still unabsorbed
+    owner = list(range(count))
+    absorbed = [False] * count
+    for i, j in zip(pairs_i.tolist(), pairs_j.tolist()):
+        if not absorbed[i] and not absorbed[j]:
+            absorbed[j] = True
+            owner[j] = i
+    owner = np.array(owner)
+    
+    # Score-weighted fusion per group. ufunc.at accumulates in index order, so
+    # the sums match merge_sorted_boxes' left-to-right loop bit for bit.
+    group_size = np.bincount(owner, minlength=count)
+    member_scores = np.zeros(count)
+    np.add.at(member_scores, owner[absorbed], scores[absorbed])
+    total_scores = scores + member_scores
+    weights = scores / total_scores[owner]
+    merged_boxes = np.zeros((count, 4))
+    np.add.at(merged_boxes, owner, boxes * weights[:, None])
+    
+    merged_detections = []
+    for i in np.flatnonzero(~np.array(absorbed, dtype=bool)).tolist():
+        current = sorted_detections[i]
+        if group_size[i] > 1:
+            current.box = tuple(merged_boxes[i].tolist())
+            current.scores = [float(total_scores[i] / group_size[i])]
+        merged_detections.append(current)
+    return merged_detections
+
+def merge_overlapping_boxes(detections: List[TreeDetection], iou_threshold: float = 0.5) -> List[TreeDetection]:
+    """Merge overlapping bounding boxes with IoU above threshold.
+    
+    Greedy by score: each surviving box absorbs every lower-scoring box of the
+    same label that overlaps it, and the group is fused into a score-weighted
+    box. Frames with MERGE_NUMPY_MIN_BOXES boxes or more take the vectorized
+    path; both give identical results.
+    """
+    if not detections:
+        return detections
+        
+    filtered_detections = [d for d in detections if d.id != 0]
+    image_detections = [d for d in detections if d.id == 0]
+    
+    if not filtered_detections:
+        return detections
+        
+    sorted_detections = sorted(filtered_detections, key=lambda x: x.scores[0], reverse=True)
+    if len(sorted_detections) < MERGE_NUMPY_MIN_BOXES:
+        return image_detections + merge_sorted_boxes(sorted_detections, iou_threshold)
+    return image_detections + merge_sorted_boxes_numpy(sorted_detections, iou_threshold)
 
 def get_colors(count: int):
     cmap = plt.cm.get_cmap("rainbow", count)
@@ -101,6 +203,468 @@ def cv2_to_pil(image):
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     return PIL.Image.fromarray(image)
 
+class FrameRing:
+    """
+    Fixed set of preallocated frame buffers handed out round robin, so the
+    capture loop reuses memory instead of allocating a frame per iteration.
+    count must exceed the number of frames that can be in flight at once.
+    With pinned=True (and CUDA) the buffers are page-locked, so uploading
+    them to the GPU is a straight DMA.
+    """
+    def __init__(self, count, pinned=False):
+        self.count = count
+        self.pinned = pinned and torch.cuda.is_available()
+        self.buffers = []
+        self.shape = None
+        self.next = 0
+        self.allocations = 0
+    
+    def take(self, shape):
+        if shape != self.shape:
+            if self.pinned:
+                self.buffers = [torch.empty(shape, dtype=torch.uint8, pin_memory=True).numpy() for _ in range(self.count)]
+            else:
+                self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.count)]
+            self.shape = shape
+            self.allocations += self.count
+        buffer = self.buffers[self.next]
+        self.next = (self.next + 1) % self.count
+        return buffer
+    
+    def copy(self, frame):
+        """Copy a frame into the next buffer."""
+        buffer = self.take(frame.shape)
+        np.copyto(buffer, frame)
+        return buffer
+
+class BgrFrame:
+    """
+    A BGR uint8 frame passed to the predictor in place of a PIL image.
+    TreePredictor only reads the image's size and hands it to its image
+    preprocessor, which BgrImagePreprocessor makes understand this type.
+    """
+    __slots__ = ("array", "width", "height")
+    
+    def __init__(self, array):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+
+class BgrImagePreprocessor(torch.nn.Module):
+    """
+    Stands in for predictor.image_preprocessor. BgrFrames are uploaded as
+    raw uint8 into a preallocated device buffer, then channel reorder
+    (BGR -> RGB), HWC -> CHW, float conversion and normalisation happen on
+    the device into a preallocated input tensor: no cvtColor, no PIL image,
+    and no host-side float copy. Anything else goes to the wrapped
+    preprocessor unchanged. It is a module itself, with the original as a
+    child (so its mean/std buffers follow .to()), because TreePredictor
+    only accepts a module in that slot.
+    """
+    def __init__(self, preprocessor):
+        super().__init__()
+        self.preprocessor = preprocessor
+        self.device_frame = None  # uint8 H x W x 3
+        self.device_input = None  # 1 x 3 x H x W, normalised
+        self.frames = 0
+        self.allocations = 0
+    
+    def forward(self, image, inplace=False):
+        return self.preprocessor(image, inplace)
+    
+    def preprocess_tensor_image(self, image):
+        return self.preprocessor.preprocess_tensor_image(image)
+    
+    def preprocess_pil_image(self, image):
+        if isinstance(image, BgrFrame):
+            return self.preprocess_bgr(image.array)
+        return self.preprocessor.preprocess_pil_image(image)
+    
+    @torch.no_grad()
+    def preprocess_bgr(self, frame):
+        mean, std = self.preprocessor.mean, self.preprocessor.std
+        height, width = frame.shape[:2]
+        if self.device_input is None or self.device_input.shape[2:] != (height, width):
+            self.device_frame = torch.empty((height, width, 3), dtype=torch.uint8, device=mean.device)
+            self.device_input = torch.empty((1, 3, height, width), dtype=mean.dtype, device=mean.device)
+            self.allocations += 2
+        
+        # Pinned frames (from a pinned FrameRing) upload without a staging copy
+        self.device_frame.copy_(torch.from_numpy(frame), non_blocking=True)
+        for rgb_channel, bgr_channel in enumerate((2, 1, 0)):
+            self.device_input[0, rgb_channel].copy_(self.device_frame[:, :, bgr_channel])
+        self.frames += 1
+        return self.device_input.sub_(mean).div_(std)
+
+def install_bgr_input(predictor):
+    """Let the predictor take BgrFrames. Returns False if it has no image
+    preprocessor to wrap, in which case it keeps getting PIL images."""
+    if isinstance(predictor, ReplayPredictor):
+        return True  # only reads the image size
+    if not hasattr(predictor, "image_preprocessor"):
+        return False
+    if not isinstance(predictor.image_preprocessor, BgrImagePreprocessor):
+        predictor.image_preprocessor = BgrImagePreprocessor(predictor.image_preprocessor)
+    return True
+
+# Memory budgets for cached prompt trees/encodings and per-label text encodings
+PROMPT_CACHE_BYTES = 16 * 1024 * 1024
+LABEL_CACHE_BYTES = 32 * 1024 * 1024
+
+def normalize_prompt(prompt):
+    """Collapse runs of whitespace so trivially different prompts share a cache entry."""
+    return " ".join(prompt.split())
+
+def encoding_nbytes(encoding):
+    """Bytes held by the tensors of a CLIP/OWL text encoding output."""
+    return sum(
+        value.numel() * value.element_size()
+        for value in vars(encoding).values()
+        if hasattr(value, "element_size")
+    )
+
+class ByteBudgetLRU:
+    """OrderedDict-backed LRU that evicts least recently used entries past a byte budget."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+    
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_bytes
+    
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses}
+
+TEXT_ENCODING_TYPES = {"clip": ClipEncodeTextOutput, "owl": OwlEncodeTextOutput}
+
+class PromptEncodingCache:
+    """
+    Caches parsed trees and CLIP/OWL text encodings by normalized prompt, and
+    the encodings of individual labels underneath that, so a new prompt only
+    encodes the labels that have not been seen before. Label encodings missing
+    from memory are looked up in the on-disk embedding stores (when set)
+    before falling back to the text encoders, and new ones are written back.
+    Used only from the inference thread.
+    """
+    def __init__(self, prompt_bytes=PROMPT_CACHE_BYTES, label_bytes=LABEL_CACHE_BYTES):
+        self.prompts = ByteBudgetLRU(prompt_bytes)
+        self.labels = ByteBudgetLRU(label_bytes)
+        self.disk_stores = {}  # kind -> TextEmbeddingStore
+        self.disk_hits = 0
+    
+    def encode_labels(self, kind, tree, label_indices, text_model):
+        """Per-label encodings for the tree's labels, keyed by label index like
+        TreePredictor.encode_clip_text/encode_owl_text."""
+        if len(label_indices) == 0:
+            return {}
+        encodings = {}
+        missing = []
+        for index in label_indices:
+            encoding = self.labels.get((kind, tree.labels[index]))
+            if encoding is None:
+                missing.append(index)
+            else:
+                encodings[index] = encoding
+        
+        missing_labels = list(dict.fromkeys(tree.labels[index] for index in missing))
+        new_encodings = {}
+        store = self.disk_stores.get(kind)
+        if missing_labels and store is not None:
+            found, embeds = store.get_many(missing_labels)
+            if found:
+                device = getattr(text_model, "device", "cuda")
+                stored = TEXT_ENCODING_TYPES[kind](text_embeds=torch.from_numpy(np.array(embeds)).to(device))
+                for i, label in enumerate(found):
+                    new_encodings[label] = stored.slice(i, i + 1)
+                self.disk_hits += len(found)
+        
+        to_encode = [label for label in missing_labels if label not in new_encodings]
+        if to_encode:
+            text_encodings = text_model.encode_text(to_encode)
+            for i, label in enumerate(to_encode):
+                new_encodings[label] = text_encodings.slice(i, i + 1)
+            if store is not None:
+                store.put_many(to_encode, text_encodings.text_embeds.detach().cpu().numpy())
+        
+        for label, encoding in new_encodings.items():
+            self.labels.put((kind, label), encoding, encoding_nbytes(encoding))
+        for index in missing:
+            encodings[index] = new_encodings[tree.labels[index]]
+        return encodings
+    
+    def encode(self, prompt):
+        key = normalize_prompt(prompt)
+        cached = self.prompts.get(key)
+        if cached is not None:
+            return cached
+        
+        tree = Tree.from_prompt(key)
+        clip_encodings = self.encode_labels(
+            "clip", tree, tree.get_classify_label_indices(), predictor.clip_predictor
+        )
+        owl_encodings = self.encode_labels(
+            "owl", tree, tree.get_detect_label_indices(), predictor.owl_predictor
+        )
+        nbytes = sum(encoding_nbytes(e) for e in list(clip_encodings.values()) + list(owl_encodings.values()))
+        result = (tree, clip_encodings, owl_encodings)
+        self.prompts.put(key, result, nbytes)
+        return result
+    
+    def stats(self):
+        return {
+            "prompts": self.prompts.stats(),
+            "labels": self.labels.stats(),
+            "disk_hits": self.disk_hits,
+            "disk_labels": {kind: len(store) for kind, store in self.disk_stores.items()}
+        }
+
+prompt_cache = PromptEncodingCache()
+
+def encode_prompt(prompt):
+    """Parse a prompt and encode its CLIP/OWL text, through the prompt cache.
+    Runs on the inference thread."""
+    return prompt_cache.encode(prompt)
+
+class LatencyStats:
+    """Rolling window of durations (seconds) summarised as percentiles, plus
+    lifetime count and total for Prometheus."""
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+    
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+    
+    def quantiles(self, qs=(0.5, 0.95, 0.99)):
+        """Quantiles of the window in seconds, or None if empty."""
+        if not self.samples:
+            return None
+        return dict(zip(qs, np.quantile(np.fromiter(self.samples, dtype=float), qs)))
+    
+    def summary(self):
+        if not self.samples:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=float), [50, 95, 99]) * 1000
+        return {
+            "count": len(self.samples),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2)
+        }
+
+# Inference runs on one dedicated thread so GPU work never blocks the event loop
+INFERENCE_QUEUE_SIZE = 2  # max predictor calls waiting on the inference thread
+
+class InferenceWorker:
+    """
+    Run predictor calls on a dedicated worker thread and await the result.
+    The hand-off is bounded, so callers wait for a free slot instead of
+    piling work up behind the GPU.
+    """
+    def __init__(self, max_pending=INFERENCE_QUEUE_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.max_pending = max_pending
+        self.slots = None  # created inside the running loop
+        self.pending = 0
+        self.latency = LatencyStats()
+    
+    async def run(self, fn, *args, **kwargs):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        async with self.slots:
+            self.pending += 1
+            try:
+                start = time.perf_counter()
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(fn, *args, **kwargs)
+                )
+                self.latency.add(time.perf_counter() - start)
+                return result
+            finally:
+                self.pending -= 1
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+inference_worker = InferenceWorker()
+
+# Per-route handler latency, used to check control responsiveness under load
+route_latency = defaultdict(LatencyStats)
+LONG_LIVED_ROUTES = {"/video-feed", "/video-feed/{camera}", "/ws"}
+
+@middleware
+async def latency_middleware(request, handler):
+    # Keyed by route pattern, so arbitrary URLs and 404s can't add entries (or metric series)
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    if route in LONG_LIVED_ROUTES:
+        return await handler(request)
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        route_latency[route].add(time.perf_counter() - start)
+
+async def handle_stats(request):
+    return web.json_response({
+        "routes": {path: stats.summary() for path, stats in route_latency.items()},
+        "inference": dict(inference_worker.latency.summary(), pending=inference_worker.pending),
+        "stream_clients": sum(len(broadcaster.subscribers) for broadcaster in frame_broadcasters.values()),
+        "stream": {camera: broadcaster.stats() for camera, broadcaster in frame_broadcasters.items()},
+        "prompt_cache": prompt_cache.stats(),
+        "serial": command_writer.stats(),
+        "pipeline": {
+            camera: broadcaster.pipeline.stats() if broadcaster.pipeline else None
+            for camera, broadcaster in frame_broadcasters.items()
+        },
+        "recorder": session_recorder.stats() if session_recorder else None
+    })
+
+class MetricsText:
+    """Builds a Prometheus text-format (0.0.4) exposition, one metric family at a time."""
+    PREFIX = "jetson"
+    
+    def __init__(self):
+        self.lines = []
+    
+    def family(self, name, kind, help_text):
+        self.lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {self.PREFIX}_{name} {kind}")
+    
+    @staticmethod
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    
+    @staticmethod
+    def format_value(value):
+        """Full precision, so large counters and sums don't step in rate()."""
+        value = float(value)
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    
+    def sample(self, name, value, **labels):
+        if labels:
+            label_text = ",".join(f'{key}="{self.escape(val)}"' for key, val in labels.items())
+            self.lines.append(f"{self.PREFIX}_{name}{{{label_text}}} {self.format_value(value)}")
+        else:
+            self.lines.append(f"{self.PREFIX}_{name} {self.format_value(value)}")
+    
+    def summary(self, name, stats, **labels):
+        """Rolling-window quantiles plus lifetime sum and count of a LatencyStats."""
+        for q, value in (stats.quantiles() or {}).items():
+            self.sample(name, value, quantile=q, **labels)
+        self.sample(f"{name}_sum", stats.total, **labels)
+        self.sample(f"{name}_count", stats.count, **labels)
+    
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+async def handle_metrics(request):
+    metrics = MetricsText()
+    pipelines = {camera: broadcaster.pipeline for camera, broadcaster in frame_broadcasters.items() if broadcaster.pipeline}
+    
+    if pipelines:
+        metrics.family("stage_latency_seconds", "summary", "Time spent in each pipeline stage")
+        for camera, pipeline in pipelines.items():
+            for stage, stats in pipeline.stage_latency.items():
+                metrics.summary("stage_latency_seconds", stats, camera=camera, stage=stage)
+        metrics.family("glass_latency_seconds", "summary",
+                       "Age of a live frame's capture timestamp when it is read, detected, decided on and streamed")
+        for camera, pipeline in pipelines.items():
+            for point, stats in pipeline.glass_latency.items():
+                if stats.count:
+                    metrics.summary("glass_latency_seconds", stats, camera=camera, point=point)
+        metrics.family("camera_frames_discarded_total", "counter", "Camera frames replaced by a newer one before the pipeline read them")
+        for camera, pipeline in pipelines.items():
+            if pipeline.source and "discarded" in pipeline.source.stats():
+                metrics.sample("camera_frames_discarded_total", pipeline.source.discarded, camera=camera)
+        metrics.family("fps", "gauge", "Events per second over a 2s window")
+        for camera, pipeline in pipelines.items():
+            for name, meter in pipeline.fps.items():
+                metrics.sample("fps", meter.rate(), camera=camera, meter=name)
+        metrics.family("frames_dropped_total", "counter", "Frames shed by a full pipeline queue")
+        for camera, pipeline in pipelines.items():
+            for name, queue in pipeline.queues.items():
+                metrics.sample("frames_dropped_total", queue.dropped, camera=camera, queue=name)
+        metrics.family("inference_skipped_total", "counter", "Frames streamed without running the detector")
+        for camera, pipeline in pipelines.items():
+            metrics.sample("inference_skipped_total", pipeline.skipped_inference, camera=camera)
+        metrics.family("scene_gate_frames_total", "counter", "Frames checked by the scene-change gate, by decision")
+        for camera, pipeline in pipelines.items():
+            metrics.sample("scene_gate_frames_total", pipeline.gate.passed, camera=camera, decision="passed")
+            metrics.sample("scene_gate_frames_total", pipeline.gate.skipped, camera=camera, decision="skipped")
+        metrics.family("scene_gate_gpu_seconds_saved", "gauge", "Estimated detector time saved by frames the scene-change gate skipped")
+        for camera, pipeline in pipelines.items():
+            metrics.sample("scene_gate_gpu_seconds_saved", pipeline.gate.stats(pipeline.stage_latency["infer"])["gpu_seconds_saved"],
+                           camera=camera)
+    
+    metrics.family("inference_latency_seconds", "summary", "Predictor calls on the inference thread, including queueing")
+    metrics.summary("inference_latency_seconds", inference_worker.latency)
+    metrics.family("route_latency_seconds", "summary", "HTTP handler time per route")
+    for path, stats in list(route_latency.items()):
+        metrics.summary("route_latency_seconds", stats, route=path)
+    
+    metrics.family("stream_clients", "gauge", "Connected /video-feed clients")
+    for camera, broadcaster in frame_broadcasters.items():
+        metrics.sample("stream_clients", len(broadcaster.subscribers), camera=camera)
+    metrics.family("stream_frames_dropped_total", "counter", "Frames replaced before a slow stream client read them")
+    for camera, broadcaster in frame_broadcasters.items():
+        metrics.sample("stream_frames_dropped_total", broadcaster.dropped, camera=camera)
+    metrics.family("stream_frames_skipped_total", "counter", "Frames not written because a client's socket was backed up")
+    for camera, broadcaster in frame_broadcasters.items():
+        metrics.sample("stream_frames_skipped_total", broadcaster.skipped, camera=camera)
+    metrics.family("stream_clients_by_level", "gauge", "Connected /video-feed clients per adaptive quality level")
+    for camera, broadcaster in frame_broadcasters.items():
+        levels = [client.level for client in broadcaster.subscribers]
+        for level in range(len(STREAM_LEVELS)):
+            metrics.sample("stream_clients_by_level", levels.count(level), camera=camera, level=level)
+    metrics.family("jpeg_encoder_info", "gauge", "Stream JPEG encoder backend")
+    metrics.sample("jpeg_encoder_info", 1, backend=jpeg_encoder.name)
+    
+    serial_stats = command_writer.stats()
+    metrics.family("serial_queue_depth", "gauge", "Motor commands waiting for the serial writer")
+    metrics.sample("serial_queue_depth", serial_stats["queue_depth"])
+    metrics.family("serial_commands_total", "counter", "Motor commands by outcome")
+    metrics.sample("serial_commands_total", serial_stats["sent"], outcome="sent")
+    metrics.sample("serial_commands_total", serial_stats["dropped"], outcome="superseded")
+    metrics.sample("serial_commands_total", serial_stats["failed"], outcome="failed")
+    for outcome in ("acked", "lost", "nacked"):
+        metrics.sample("serial_commands_total", serial_stats["acks"][outcome], outcome=outcome)
+    metrics.family("serial_write_seconds", "summary", "Blocking serial write time")
+    metrics.summary("serial_write_seconds", command_writer.write_latency)
+    metrics.family("serial_ack_rtt_seconds", "summary", "Command to ESP32 ack round trip")
+    metrics.summary("serial_ack_rtt_seconds", command_writer.ack_latency)
+    
+    if session_recorder:
+        metrics.family("recorder_records_dropped_total", "counter", "Session records dropped because the writer fell behind")
+        metrics.sample("recorder_records_dropped_total", session_recorder.dropped)
+    
+    return web.Response(body=metrics.text().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
 async def handle_index_get(request: web.Request):
     print("handle_index_get")
     return web.FileResponse("./index.html")
@@ -120,13 +684,16 @@ async def websocket_handler(request):
                 header, prompt = msg.data.split(":")
                 print("Received prompt: " + prompt)
                 try:
-                    tree = Tree.from_prompt(prompt)
-                    clip_encodings = predictor.encode_clip_text(tree)
-                    owl_encodings = predictor.encode_owl_text(tree)
+                    tree, clip_encodings, owl_encodings = await inference_worker.run(encode_prompt, prompt)
+                    # Keep the current target/obstacle split; the websocket only sends the prompt
+                    previous = prompt_data or {}
                     prompt_data = {
                         "tree": tree,
                         "clip_encodings": clip_encodings,
-                        "owl_encodings": owl_encodings
+                        "owl_encodings": owl_encodings,
+                        "target": previous.get("target", "entrapped survivor"),
+                        "target_objects": previous.get("target_objects", []),
+                        "obstacles": previous.get("obstacles", [])
                     }
                     print("Set prompt: " + prompt)
                 except Exception as e:
@@ -208,75 +775,296 @@ TRACKING_THRESHOLD = 3  # frames before a box is considered valid
 IOU_THRESHOLD = 0.6    # threshold for considering boxes to be the same between frames
 IOU_THRESHOLD_FOR_MERGING = 0.6 # threshold for merging overlapping boxes (higher = less merging)
 MISSING_THRESHOLD = 2  # frames before a box is considered gone
-current_tracked_boxes = []  # list of currently tracked boxes
 
-# Modify the TrackedBox class to track missing frames
 class TrackedBox:
-    def __init__(self, detection, label_map):
-        self.box = detection.box
-        self.labels = [label_map[label] for label in detection.labels]
-        self.scores = detection.scores
-        self.frame_count = 1
-        self.missing_frames = 0
-        self.last_seen = time.time()
-    
-    def update(self, new_detection, label_map):
-        self.box = new_detection.box
-        self.labels = [label_map[label] for label in new_detection.labels]
-        self.scores = new_detection.scores
-        self.frame_count += 1
-        self.missing_frames = 0
-        self.last_seen = time.time()
-    
-    def mark_missing(self):
-        self.missing_frames += 1
-    
-    def is_valid(self):
-        return (self.frame_count >= TRACKING_THRESHOLD and 
-                self.missing_frames < MISSING_THRESHOLD)
-
-# Modify the update_tracked_boxes function
-def update_tracked_boxes(detections, label_map):
-    global current_tracked_boxes
-    current_time = time.time()
-    
-    # First mark all boxes as missing
-    for box in current_tracked_boxes:
-        box.mark_missing()
-    
-    # Match new detections to existing tracked boxes
-    matched_detections = set()
-    for i, detection in enumerate(detections):
-        if detection.id == 0:  # Skip image-level detections
-            continue
+    """Lightweight snapshot of one valid track, used for drawing and autonomous control."""
+    __slots__ = ("track_id", "box", "labels", "scores")
+    
+    def __init__(self, track_id, box, labels, scores):
+        self.track_id = track_id
+        self.box = box
+        self.labels = labels
+        self.scores = scores
+
+# Constant-velocity Kalman filter over (cx, cy, w, h) and their rates, in pixels and seconds
+KALMAN_ACCEL_NOISE = 300.0       # std of unmodelled acceleration (px/s^2)
+KALMAN_MEASUREMENT_NOISE = 4.0   # std of a detection box edge (px)
+MAX_PREDICTION_SECONDS = 0.5     # never extrapolate a track further than this past its last update
+KALMAN_H = np.hstack([np.eye(4), np.zeros((4, 4))])
+
+def boxes_to_states(boxes):
+    """x1, y1, x2, y2 boxes -> cx, cy, w, h measurements."""
+    return np.stack([
+        (boxes[:, 0] + boxes[:, 2]) / 2,
+        (boxes[:, 1] + boxes[:, 3]) / 2,
+        boxes[:, 2] - boxes[:, 0],
+        boxes[:, 3] - boxes[:, 1]
+    ], axis=1)
+
+def states_to_boxes(states):
+    """cx, cy, w, h (+ rates) states -> x1, y1, x2, y2 boxes."""
+    half_w = np.maximum(states[:, 2], 1.0) / 2
+    half_h = np.maximum(states[:, 3], 1.0) / 2
+    return np.stack([
+        states[:, 0] - half_w,
+        states[:, 1] - half_h,
+        states[:, 0] + half_w,
+        states[:, 1] + half_h
+    ], axis=1)
+
+class TrackTable:
+    """
+    Struct-of-arrays store for tracked boxes. Every track owns a slot in
+    preallocated NumPy arrays and is looked up through an id-to-slot index, so
+    marking missing, updating matches, pruning and validity checks are single
+    vectorized operations. Arrays only reallocate when the table has to grow.
+    
+    Each track also carries a constant-velocity Kalman state. Detections are
+    matched against boxes predicted to the frame's capture time, and frames
+    without inference are drawn from the propagated state.
+    """
+    def __init__(self, capacity=64):
+        self.lock = threading.Lock()  # the track and overlay threads both read the table
+        self.next_id = 1
+        self.slot_of = {}  # track id -> slot
+        self.boxes = np.zeros((capacity, 4))
+        self.scores = np.zeros(capacity)
+        self.frame_counts = np.zeros(capacity, dtype=np.int32)
+        self.missing_frames = np.zeros(capacity, dtype=np.int32)
+        self.track_ids = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.primary_labels = np.empty(capacity, dtype=object)
+        self.states = np.zeros((capacity, 8))
+        self.covariances = np.zeros((capacity, 8, 8))
+        self.state_times = np.zeros(capacity)
+        # Per-slot label names and scores, shared with the detection rather than copied
+        self.labels = [None] * capacity
+        self.label_scores = [None] * capacity
+    
+    def __len__(self):
+        return len(self.slot_of)
+    
+    def grow(self, capacity):
+        extra = capacity - len(self.active)
+        self.boxes = np.concatenate([self.boxes, np.zeros((extra, 4))])
+        self.scores = np.concatenate([self.scores, np.zeros(extra)])
+        self.frame_counts = np.concatenate([self.frame_counts, np.zeros(extra, dtype=np.int32)])
+        self.missing_frames = np.concatenate([self.missing_frames, np.zeros(extra, dtype=np.int32)])
+        self.track_ids = np.concatenate([self.track_ids, np.zeros(extra, dtype=np.int64)])
+        self.active = np.concatenate([self.active, np.zeros(extra, dtype=bool)])
+        self.primary_labels = np.concatenate([self.primary_labels, np.empty(extra, dtype=object)])
+        self.states = np.concatenate([self.states, np.zeros((extra, 8))])
+        self.covariances = np.concatenate([self.covariances, np.zeros((extra, 8, 8))])
+        self.state_times = np.concatenate([self.state_times, np.zeros(extra)])
+        self.labels.extend([None] * extra)
+        self.label_scores.extend([None] * extra)
+    
+    def set_labels(self, slot, labels, scores):
+        self.labels[slot] = labels
+        self.label_scores[slot] = scores
+        self.primary_labels[slot] = labels[0]
+        self.scores[slot] = scores[0]
+    
+    def add(self, boxes, labels, scores, timestamp):
+        """Start new tracks in free slots, growing the table if needed."""
+        free = np.flatnonzero(~self.active)
+        if free.size < len(boxes):
+            self.grow(max(2 * len(self.active), len(self.active) + len(boxes)))
+            free = np.flatnonzero(~self.active)
+        slots = free[:len(boxes)]
+        ids = np.arange(self.next_id, self.next_id + len(boxes))
+        self.next_id += len(boxes)
+        
+        self.boxes[slots] = boxes
+        self.frame_counts[slots] = 1
+        self.missing_frames[slots] = 0
+        self.track_ids[slots] = ids
+        self.active[slots] = True
+        
+        # Start at rest, certain about the box and uncertain about its velocity
+        self.states[slots] = 0.0
+        self.states[slots, :4] = boxes_to_states(boxes)
+        self.covariances[slots] = np.diag([
+            KALMAN_MEASUREMENT_NOISE ** 2] * 4 + [(KALMAN_ACCEL_NOISE * MAX_PREDICTION_SECONDS) ** 2] * 4
+        )
+        self.state_times[slots] = timestamp
+        
+        for slot, track_id, slot_labels, slot_scores in zip(slots.tolist(), ids.tolist(), labels, scores):
+            self.slot_of[track_id] = slot
+            self.set_labels(slot, slot_labels, slot_scores)
+    
+    def predict(self, slots, timestamp):
+        """Propagate the Kalman state and covariance of the given slots to timestamp."""
+        dt = np.clip(timestamp - self.state_times[slots], 0.0, MAX_PREDICTION_SECONDS)
+        transition = np.broadcast_to(np.eye(8), (len(slots), 8, 8)).copy()
+        transition[:, range(4), range(4, 8)] = dt[:, None]
+        
+        # White-noise acceleration model, applied to each of the four axes
+        q = KALMAN_ACCEL_NOISE ** 2
+        noise = np.zeros((len(slots), 8, 8))
+        noise[:, range(4), range(4)] = (q * dt ** 4 / 4)[:, None]
+        noise[:, range(4), range(4, 8)] = (q * dt ** 3 / 2)[:, None]
+        noise[:, range(4, 8), range(4)] = (q * dt ** 3 / 2)[:, None]
+        noise[:, range(4, 8), range(4, 8)] = (q * dt ** 2)[:, None]
+        
+        self.states[slots] = np.einsum('nij,nj->ni', transition, self.states[slots])
+        self.covariances[slots] = transition @ self.covariances[slots] @ transition.transpose(0, 2, 1) + noise
+        self.state_times[slots] = timestamp
+        self.boxes[slots] = states_to_boxes(self.states[slots])
+    
+    def correct(self, slots, boxes):
+        """Kalman measurement update of the given slots with detected boxes."""
+        covariances = self.covariances[slots]
+        innovation = boxes_to_states(boxes) - self.states[slots, :4]
+        innovation_cov = KALMAN_H @ covariances @ KALMAN_H.T + np.eye(4) * KALMAN_MEASUREMENT_NOISE ** 2
+        gain = covariances @ KALMAN_H.T @ np.linalg.inv(innovation_cov)
+        
+        self.states[slots] += np.einsum('nij,nj->ni', gain, innovation)
+        self.covariances[slots] = (np.eye(8) - gain @ KALMAN_H) @ covariances
+        self.boxes[slots] = states_to_boxes(self.states[slots])
+    
+    def update(self, detections, label_map, timestamp=None):
+        """Match a frame's detections to tracks and return the valid tracks.
+        timestamp is the frame's capture time on the time.monotonic() clock."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self.lock:
+            active_slots = np.flatnonzero(self.active)
+            
+            # First mark all boxes as missing, and move them to where they should be now
+            self.missing_frames[active_slots] += 1
+            self.predict(active_slots, timestamp)
+            
+            # Skip image-level detections
+            objects = [d for d in detections if d.id != 0]
+            det_boxes = np.array([d.box for d in objects], dtype=np.float64).reshape(-1, 4)
+            det_labels = [[label_map[label] for label in d.labels] for d in objects]
             
-        best_match = None
-        best_iou = IOU_THRESHOLD
-        best_idx = -1
-        
-        # Find best matching existing box
-        for j, tracked_box in enumerate(current_tracked_boxes):
-            iou = calculate_iou(detection.box, tracked_box.box)
-            if iou > best_iou:
-                best_iou = iou
-                best_match = tracked_box
-                best_idx = j
-        
-        if best_match is not None:
-            best_match.update(detection, label_map)
-            matched_detections.add(i)
-    
-    # Add new detections that weren't matched
-    for i, detection in enumerate(detections):
-        if detection.id != 0 and i not in matched_detections:
-            current_tracked_boxes.append(TrackedBox(detection, label_map))
-    
-    # Remove boxes that have been missing too long
-    current_tracked_boxes = [box for box in current_tracked_boxes 
-                           if box.missing_frames < MISSING_THRESHOLD]
-    
-    # Return only valid boxes
-    return [box for box in current_tracked_boxes if box.is_valid()]
+            # Match new detections to existing tracked boxes
+            matches = match_detections(
+                det_boxes,
+                [labels[0] for labels in det_labels],
+                self.boxes[active_slots],
+                self.primary_labels[active_slots]
+            )
+            matched = np.zeros(len(objects), dtype=bool)
+            if matches:
+                rows, cols = np.array(matches).T
+                slots = active_slots[cols]
+                self.correct(slots, det_boxes[rows])
+                self.frame_counts[slots] += 1
+                self.missing_frames[slots] = 0
+                matched[rows] = True
+                for row, slot in zip(rows.tolist(), slots.tolist()):
+                    self.set_labels(slot, det_labels[row], objects[row].scores)
+            
+            # Add new detections that weren't matched
+            new_rows = np.flatnonzero(~matched).tolist()
+            if new_rows:
+                self.add(
+                    det_boxes[new_rows],
+                    [det_labels[row] for row in new_rows],
+                    [objects[row].scores for row in new_rows],
+                    timestamp
+                )
+            
+            # Remove boxes that have been missing too long
+            gone = np.flatnonzero(self.active & (self.missing_frames >= MISSING_THRESHOLD))
+            self.active[gone] = False
+            for track_id in self.track_ids[gone].tolist():
+                del self.slot_of[track_id]
+            
+            slots = np.flatnonzero(self.valid_mask())
+            return self.views(slots, self.boxes[slots])
+    
+    def valid_mask(self):
+        return (self.active &
+                (self.frame_counts >= TRACKING_THRESHOLD) &
+                (self.missing_frames < MISSING_THRESHOLD))
+    
+    def valid_boxes(self):
+        """Snapshot views of the valid tracks as of their last update."""
+        with self.lock:
+            slots = np.flatnonzero(self.valid_mask())
+            return self.views(slots, self.boxes[slots])
+    
+    def predicted_boxes(self, timestamp):
+        """Snapshot views of the valid tracks with boxes extrapolated to timestamp,
+        for frames that were not run through the detector. Leaves the state alone."""
+        with self.lock:
+            slots = np.flatnonzero(self.valid_mask())
+            dt = np.clip(timestamp - self.state_times[slots], -MAX_PREDICTION_SECONDS, MAX_PREDICTION_SECONDS)
+            states = self.states[slots]
+            return self.views(slots, states_to_boxes(states[:, :4] + states[:, 4:] * dt[:, None]))
+    
+    def views(self, slots, boxes):
+        """TrackedBox snapshots for slots, with boxes given row-aligned to slots."""
+        return [
+            TrackedBox(track_id, tuple(box), self.labels[slot], self.label_scores[slot])
+            for slot, track_id, box in zip(slots.tolist(), self.track_ids[slots].tolist(), boxes.tolist())
+        ]
+
+track_table = TrackTable()
+
+LABEL_GATING = True  # only match a detection to a track with the same primary label
+
+def assign_by_iou(iou, iou_threshold):
+    """
+    One-to-one assignment of rows to columns maximizing total IoU, keeping only
+    pairs above iou_threshold. Uses the Hungarian solver when scipy is present,
+    otherwise takes pairs greedily from highest IoU down.
+    """
+    iou = np.where(iou > iou_threshold, iou, 0.0)
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(iou, maximize=True)
+    else:
+        rows, cols = [], []
+        used_rows, used_cols = set(), set()
+        for flat in np.argsort(-iou, axis=None, kind='stable').tolist():
+            row, col = divmod(flat, iou.shape[1])
+            if iou[row, col] <= 0:
+                break
+            if row not in used_rows and col not in used_cols:
+                used_rows.add(row)
+                used_cols.add(col)
+                rows.append(row)
+                cols.append(col)
+        rows, cols = np.array(rows, dtype=int), np.array(cols, dtype=int)
+    keep = iou[rows, cols] > 0
+    return rows[keep], cols[keep]
+
+def match_detections(det_boxes, det_labels, track_boxes, track_labels, iou_threshold=None, gate_by_label=None):
+    """
+    Match detections to tracks from a single IoU matrix. With label gating the
+    assignment is solved per label, so cost grows with the size of each label
+    group rather than with the total number of tracks.
+    Returns a list of (detection index, track index) pairs.
+    """
+    iou_threshold = IOU_THRESHOLD if iou_threshold is None else iou_threshold
+    gate_by_label = LABEL_GATING if gate_by_label is None else gate_by_label
+    if len(det_boxes) == 0 or len(track_boxes) == 0:
+        return []
+    
+    iou = iou_matrix(det_boxes, track_boxes)
+    if not gate_by_label:
+        rows, cols = assign_by_iou(iou, iou_threshold)
+        return list(zip(rows.tolist(), cols.tolist()))
+    
+    det_labels = np.asarray(det_labels, dtype=object)
+    track_labels = np.asarray(track_labels, dtype=object)
+    matches = []
+    for label in set(det_labels.tolist()):
+        det_idx = np.flatnonzero(det_labels == label)
+        track_idx = np.flatnonzero(track_labels == label)
+        if track_idx.size == 0:
+            continue
+        rows, cols = assign_by_iou(iou[np.ix_(det_idx, track_idx)], iou_threshold)
+        matches.extend(zip(det_idx[rows].tolist(), track_idx[cols].tolist()))
+    return matches
+
+def update_tracked_boxes(detections, label_map, timestamp=None, tracks=None):
+    """Update a camera's track table (the primary camera's by default) with a
+    frame's detections; returns the valid tracks."""
+    return (track_table if tracks is None else tracks).update(detections, label_map, timestamp)
 
 # Movement control globals
 OBSTACLE_SIZE_THRESHOLD = 0.4  # If obstacle takes up more than 40% of image width, move backward
@@ -292,47 +1080,227 @@ class Command(Enum):
     RIGHT = auto()
     STOP = auto()
 
-# Initialize serial connection
-try:
-    serial_port = serial.Serial('/dev/ttyTHS1', 115200)
-    print("🔌 Serial connection established")
-except Exception as e:
-    print(f"❌ Failed to open serial port: {e}")
-    serial_port = None
+# Serial link to the ESP32, opened when the server starts (see serial_protocol.open_transport)
+SERIAL_DEVICE = serial_protocol.SERIAL_DEVICE
 
 # Add rate limiting globals
 COMMAND_DELAY = 0.1  # 100ms between commands to avoid flooding
-last_command_time = 0  # Track last sent command time for rate limiting
 
-def send_command(command: Command):
-    """Send command to the RC car through serial port with rate limiting."""
-    global last_command_time
+MOTOR_SPEED = 255  # PWM duty (0-255) sent with every movement command; 255 is full duty, as the EN pins were before PWM
+ACK_TIMEOUT = 0.25  # seconds before an unacknowledged command counts as lost
+
+# Opcodes for the binary frame protocol (see serial_protocol.py).
+# LEFT/RIGHT are swapped to match the motor wiring, as with the old "R"/"L" letters.
+command_map = {
+    Command.FORWARD: serial_protocol.OP_FORWARD,
+    Command.BACKWARD: serial_protocol.OP_BACKWARD,
+    Command.LEFT: serial_protocol.OP_TURN_RIGHT,
+    Command.RIGHT: serial_protocol.OP_TURN_LEFT,
+    Command.STOP: serial_protocol.OP_STOP
+}
+
+class SerialCommandWriter:
+    """
+    Rate-limited, latest-wins motor command channel to the ESP32. submit never
+    blocks; framed commands are written on a writer thread and their acks are
+    matched back by sequence number on a reader thread.
+    """
+    def __init__(self, min_interval=COMMAND_DELAY, speed=MOTOR_SPEED, ack_timeout=ACK_TIMEOUT):
+        self.min_interval = min_interval
+        self.speed = speed
+        self.ack_timeout = ack_timeout
+        self.latest = None  # newest unsent movement command
+        self.stop_pending = False
+        self.wakeup = None  # created inside the running loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serial")
+        self.write_latency = LatencyStats()
+        self.last_write_time = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        
+        # Ack tracking, shared between the writer and reader threads
+        self.seq = 0
+        self.outstanding = {}  # seq -> (send time, command), counted lost after ack_timeout
+        self.ack_lock = threading.Lock()
+        self.ack_latency = LatencyStats()
+        self.acked = 0
+        self.lost = 0
+        self.nacked = 0  # acks with a non-OK status
+        self.unmatched_acks = 0  # acks for a seq we were not waiting on (late or duplicate)
+        self.remote_rx_errors = 0  # frames the ESP32 reports rejecting
+        self.parser = serial_protocol.ack_parser()
+        self.reader = None
+        self.reader_running = False
+        self.port = None
     
-    if not serial_port:
-        print("❌ Serial port not available")
-        return
+    def open(self, spec=None):
+        """Open the transport to the ESP32; commands are dropped with an error if this fails."""
+        spec = spec or SERIAL_DEVICE
+        try:
+            self.port = serial_protocol.open_transport(spec)
+            print(f"🔌 Serial connection established on {spec}")
+        except Exception as e:
+            print(f"❌ Failed to open serial port: {e}")
+            self.port = None
+        return self.port
     
-    # Rate limiting
-    current_time = time.time()
-    time_since_last = current_time - last_command_time
-    if time_since_last < COMMAND_DELAY:
-        time.sleep(COMMAND_DELAY - time_since_last)
-        
-    command_map = {
-        Command.FORWARD: "F",
-        Command.BACKWARD: "B",
-        Command.LEFT: "R",
-        Command.RIGHT: "L",
-        Command.STOP: "S"
-    }
+    def close(self):
+        self.stop_reader()
+        if self.port:
+            self.port.close()
+            self.port = None
+            print("🔌 Serial connection closed")
+    
+    def submit(self, command: Command):
+        if command == Command.STOP:
+            # A stop supersedes any movement queued before it
+            self.dropped += int(self.stop_pending) + int(self.latest is not None)
+            self.latest = None
+            self.stop_pending = True
+        else:
+            # Only the newest unsent movement reaches the UART
+            if self.latest is not None:
+                self.dropped += 1
+            self.latest = command
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    def take(self):
+        """Next command to send: a pending STOP first, then the latest movement."""
+        if self.stop_pending:
+            self.stop_pending = False
+            return Command.STOP
+        command, self.latest = self.latest, None
+        return command
+    
+    def write(self, command: Command):
+        """Frame and send a command; returns its sequence number."""
+        speed = 0 if command == Command.STOP else self.speed
+        with self.ack_lock:
+            seq = self.seq
+            self.seq = (self.seq + 1) & 0xFF
+            if seq in self.outstanding:
+                # Wrapped all the way round without an ack
+                self.outstanding.pop(seq)
+                self.lost += 1
+            self.outstanding[seq] = (time.perf_counter(), command)
+        self.port.write(serial_protocol.encode_command(seq, command_map[command], speed))
+        return seq
+    
+    def handle_ack(self, ack, received_at):
+        with self.ack_lock:
+            self.remote_rx_errors = ack.rx_errors
+            entry = self.outstanding.pop(ack.seq, None)
+            if entry is None:
+                self.unmatched_acks += 1
+                return
+            sent_at, command = entry
+            self.acked += 1
+            self.ack_latency.add(received_at - sent_at)
+            if ack.status != serial_protocol.STATUS_OK:
+                self.nacked += 1
+                print(f"❌ ESP32 rejected {command.name} (seq {ack.seq}, status {ack.status})")
+    
+    def expire_outstanding(self, now):
+        with self.ack_lock:
+            expired = [seq for seq, (sent_at, _) in self.outstanding.items() if now - sent_at > self.ack_timeout]
+            for seq in expired:
+                _, command = self.outstanding.pop(seq)
+                self.lost += 1
+                print(f"⚠️ No ack for {command.name} (seq {seq})")
+    
+    def read_acks(self):
+        """Reader thread: parse ack frames from the ESP32 and expire stale commands."""
+        while self.reader_running:
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as e:
+                print(f"❌ Serial read failed: {e}")
+                time.sleep(self.ack_timeout)
+                data = b""
+            now = time.perf_counter()
+            for ack in self.parser.feed(data):
+                self.handle_ack(ack, now)
+            self.expire_outstanding(now)
+    
+    def start_reader(self):
+        if self.port and self.reader is None:
+            self.reader_running = True
+            self.reader = threading.Thread(target=self.read_acks, name="serial-acks", daemon=True)
+            self.reader.start()
+    
+    def stop_reader(self):
+        self.reader_running = False
+        if self.reader is not None:
+            self.reader.join(timeout=1.0)
+            self.reader = None
+    
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.stop_pending and self.latest is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            # Rate limiting, cut short if a STOP arrives
+            wait = self.last_write_time + self.min_interval - time.monotonic()
+            if wait > 0 and not self.stop_pending:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                if not self.stop_pending and time.monotonic() < self.last_write_time + self.min_interval:
+                    continue
+            
+            command = self.take()
+            if command is None:
+                continue
+            if not self.port:
+                print("❌ Serial port not available")
+                continue
+            try:
+                start = time.perf_counter()
+                seq = await loop.run_in_executor(self.executor, self.write, command)
+                self.write_latency.add(time.perf_counter() - start)
+                self.sent += 1
+                print(f"📡 Sent command: {command.name}")
+                if session_recorder:
+                    # Only commands that reached the UART, not ones superseded while queued
+                    session_recorder.record_command(command.name, seq)
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Failed to send command: {e}")
+            self.last_write_time = time.monotonic()
+    
+    def stats(self):
+        return {
+            "queue_depth": int(self.stop_pending) + int(self.latest is not None),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "write": self.write_latency.summary(),
+            "acks": {
+                "acked": self.acked,
+                "lost": self.lost,
+                "in_flight": len(self.outstanding),
+                "nacked": self.nacked,
+                "unmatched": self.unmatched_acks,
+                "bad_frames": self.parser.bad_frames,
+                "remote_rx_errors": self.remote_rx_errors,
+                "rtt": self.ack_latency.summary()
+            }
+        }
+
+command_writer = SerialCommandWriter()
 
+def send_command(command: Command):
+    """Queue a command for the RC car; the serial writer task rate-limits and sends it."""
     if command in command_map:
-        try:
-            serial_port.write(command_map[command].encode())
-            print(f"📡 Sent command: {command.name}")
-            last_command_time = time.time()
-        except Exception as e:
-            print(f"❌ Failed to send command: {e}")
+        command_writer.submit(command)
 
 # Update movement functions to be synchronous
 def forward():
@@ -422,7 +1390,7 @@ async def process_autonomous_movement(valid_boxes, frame_width):
     
     # If no boxes detected, move forward
     if not target_boxes and not obstacle_boxes:
-        await send_movement_command('forward')
+        send_movement_command('forward')
         return
     
     # Get largest target box if multiple targets
@@ -448,142 +1416,746 @@ async def process_autonomous_movement(valid_boxes, frame_width):
         if middle_obstacles:
             if obstacle_width_ratio > OBSTACLE_SIZE_THRESHOLD:
                 # Obstacle too close, move backward
-                await send_movement_command('backward')
+                send_movement_command('backward')
                 return
             
             # Determine which way to turn based on obstacle position
             obstacle_center = largest_obstacle[1]
             if obstacle_center < frame_width / 2:
-                await send_movement_command('right')
+                send_movement_command('right')
             else:
-                await send_movement_command('left')
+                send_movement_command('left')
             return
     
     # No obstacles in middle, handle target tracking
     if target:
         target_center = target[1]
         if target_center < left_third:
-            await send_movement_command('left')
+            send_movement_command('left')
         elif target_center > right_third:
-            await send_movement_command('right')
+            send_movement_command('right')
         else:
-            await send_movement_command('forward')
+            send_movement_command('forward')
     else:
         # No target and no obstacles, move forward
-        await send_movement_command('forward')
+        send_movement_command('forward')
 
-# Modify the handle_video_stream function
-async def handle_video_stream(request):
-    response = web.StreamResponse()
-    response.content_type = 'multipart/x-mixed-replace; boundary=frame'
-    response.headers['Cache-Control'] = 'no-cache'
-    await response.prepare(request)
+def draw_tracked_boxes(frame, valid_boxes):
+    """Draw valid tracked boxes and their labels onto a BGR frame in place."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.75
     
-    camera = cv2.VideoCapture(CAMERA_DEVICE)
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    for tracked_box in valid_boxes:
+        box = [int(x) for x in tracked_box.box]
+        pt0 = (box[0], box[1])
+        pt1 = (box[2], box[3])
+        
+        # Color based on whether it's a target or obstacle
+        is_target = any(label in prompt_data['target_objects'] for label in tracked_box.labels)
+        is_obstacle = any(label in prompt_data['obstacles'] for label in tracked_box.labels)
+        
+        if is_target:
+            color = (107, 107, 255)  # #ff6b6b in BGR
+        elif is_obstacle:
+            color = (251, 218, 97)   # #61dafb in BGR
+        else:
+            color = (128, 128, 128)  # Gray for other objects
+        
+        # Draw bounding box
+        cv2.rectangle(
+            frame,
+            pt0,
+            pt1,
+            color,
+            1
+        )
+        
+        # Draw labels with confidence scores
+        offset_y = 30
+        offset_x = 8
+        for i, label in enumerate(tracked_box.labels):
+            label_text = f"{label} ({tracked_box.scores[i]*100:.1f}%)"
+            cv2.putText(
+                frame,
+                label_text,
+                (box[0] + offset_x, box[1] + offset_y),
+                font,
+                font_scale,
+                color,
+                2,  # thickness
+                cv2.LINE_AA
+            )
+            offset_y += 18
     
-    try:
-        while True:
-            success, frame = camera.read()
-            if not success:
-                break
+    return frame
+
+# Stream quality ladder for lagging clients: (fraction of the encoder's quality, frame scale).
+# Level 0 is the full frame at full quality.
+STREAM_LEVELS = [(1.0, 1.0), (0.8, 0.75), (0.6, 0.5), (0.5, 0.35)]
+STREAM_MAX_BUFFERED = 256 * 1024  # bytes waiting in a client's socket before its frames are skipped
+STREAM_SOCKET_BUFFER = 64 * 1024  # kernel send buffer per client, small so backpressure shows up as write time
+
+class StreamClient:
+    """
+    One /video-feed viewer. Each frame's write time and the bytes still queued
+    in its socket move it along STREAM_LEVELS: down a level after a few slow
+    writes (most of a frame period, or a frame's worth still unsent) among the
+    recent ones, back up after a long run of fast ones.
+    """
+    DEGRADE_AFTER = 3  # slow writes among the last SLOW_WINDOW before dropping a level
+    SLOW_WINDOW = 10
+    UPGRADE_AFTER = 150  # fast writes in a row before trying the level above (~5s at 30 FPS)
+    
+    def __init__(self, peer=None, adaptive=True):
+        self.queue = asyncio.Queue(maxsize=1)
+        self.peer = peer
+        self.adaptive = adaptive
+        self.level = 0
+        self.write_latency = LatencyStats(window=100)
+        self.recent = deque(maxlen=self.SLOW_WINDOW)  # True for each recent slow write
+        self.fast = 0
+        self.sent = 0
+        self.skipped = 0
+    
+    def pick(self, frames):
+        """This client's encoding of a published frame, or the nearest level that was encoded."""
+        if self.level in frames:
+            return frames[self.level]
+        return frames[min(frames, key=lambda level: abs(level - self.level))]
+    
+    def observe(self, write_seconds, buffered, frame_bytes):
+        """Adjust the level after writing frame_bytes took write_seconds and left buffered bytes unsent."""
+        self.write_latency.add(write_seconds)
+        if not self.adaptive:
+            return
+        period = 1.0 / TARGET_FPS
+        slow = write_seconds > 0.5 * period or buffered > frame_bytes
+        self.recent.append(slow)
+        self.fast = 0 if slow or buffered else self.fast + 1
+        
+        if sum(self.recent) >= self.DEGRADE_AFTER and self.level < len(STREAM_LEVELS) - 1:
+            self.level += 1
+            self.recent.clear()
+            print(f"📉 Stream client {self.peer} lagging, dropping to level {self.level}")
+        elif self.fast >= self.UPGRADE_AFTER and self.level > 0:
+            self.level -= 1
+            self.fast = 0
+            self.recent.clear()
+            print(f"📈 Stream client {self.peer} keeping up, raising to level {self.level}")
+    
+    def stats(self):
+        quality, scale = STREAM_LEVELS[self.level]
+        return {
+            "peer": self.peer,
+            "level": self.level,
+            "quality": max(10, int(jpeg_encoder.quality * quality)),
+            "scale": scale,
+            "adaptive": self.adaptive,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "write": self.write_latency.summary()
+        }
+
+class FrameBroadcaster:
+    """
+    Fan out encoded JPEG frames from one producer to every /video-feed client.
+    Each subscriber gets a single-slot queue, so a slow client only ever sees
+    the newest frame and never holds up the producer. The producer encodes
+    each frame once per stream level that some client is on.
+    
+    There is one broadcaster per camera; source_factory, tracks and primary
+    are handed to its FramePipeline.
+    """
+    def __init__(self, source_factory=None, tracks=None, primary=True):
+        self.source_factory = source_factory
+        self.tracks = tracks
+        self.primary = primary
+        self.subscribers = set()
+        self.producer_task = None
+        self.stopping = None  # the last producer, until its pipeline has released the source
+        self.starting = None  # asyncio.Lock, created inside the running loop
+        self.pipeline = None
+        self.dropped = 0  # frames replaced before a subscriber read them
+        self.skipped = 0  # frames not written because a client's socket was backed up
+    
+    def subscribe(self, peer=None, adaptive=True):
+        client = StreamClient(peer, adaptive)
+        self.subscribers.add(client)
+        return client
+    
+    async def start(self):
+        """Start the shared capture loop with the first viewer. A viewer that
+        comes back right after the last one left waits for the old pipeline to
+        release the camera first, since a V4L2/CSI camera cannot be opened twice."""
+        if self.starting is None:
+            self.starting = asyncio.Lock()
+        async with self.starting:
+            if self.producer_task is not None and not self.producer_task.done():
+                return
+            if self.stopping is not None:
+                await asyncio.wait([self.stopping])
+                self.stopping = None
+            if self.subscribers:
+                self.pipeline = FramePipeline(self, PIPELINE_QUEUE_DEPTHS, self.source_factory,
+                                              tracks=self.tracks, primary=self.primary)
+                self.producer_task = asyncio.create_task(self.pipeline.run())
+    
+    def unsubscribe(self, client):
+        self.subscribers.discard(client)
+        # Release the camera once the last viewer is gone
+        if not self.subscribers and self.producer_task is not None:
+            self.producer_task.cancel()
+            self.stopping, self.producer_task = self.producer_task, None
+    
+    def levels_in_use(self):
+        return {client.level for client in self.subscribers}
+    
+    def publish(self, frames):
+        """Hand the latest frame ({level: JPEG bytes}) to every subscriber, dropping any unread one.
+        None tells subscribers the stream has ended."""
+        for client in self.subscribers:
+            if client.queue.full():
+                client.queue.get_nowait()
+                self.dropped += 1
+            client.queue.put_nowait(frames)
+    
+    def stats(self):
+        return [client.stats() for client in self.subscribers]
+
+frame_broadcaster = FrameBroadcaster()  # the primary camera, also served at /video-feed
+frame_broadcasters = {"0": frame_broadcaster}  # every camera by id, served at /video-feed/<id>
+
+# Frames each inter-stage queue may hold before the oldest one is dropped
+PIPELINE_QUEUE_DEPTHS = {"infer": 1, "overlay": 2, "encode": 2}
+
+TARGET_FPS = 30  # capture/stream rate the frame scheduler aims for
+FRAME_SOURCE = None  # video file, image directory or recorded session to play instead of the camera
+REPLAY_REALTIME = True  # play file sources at their recorded rate, or as fast as the pipeline goes
+REPLAY_FPS = 30.0  # frame rate for image directories
+session_recorder = None  # SessionRecorder when --record is given
+BGR_INPUT = False  # predictor takes BgrFrames (see install_bgr_input) instead of PIL images
+IMAGE_QUALITY = 50
+jpeg_encoder = make_encoder("opencv", IMAGE_QUALITY)  # see jpeg_encoders.py, --jpeg-encoder
+DETECTION_INTERVAL = 0.0  # minimum seconds between detector runs (0 = whenever inference is idle)
+SCENE_GATE = True  # while the robot is stopped, skip detection on frames that barely differ from the last detected one
+SCENE_CHANGE_THRESHOLD = 0.005  # fraction of thumbnail pixels that must change for a frame to count as a new scene
+SCENE_MAX_INTERVAL = 1.0  # seconds between detections even when nothing changes
+INFERENCE_ROI = None  # (x0, y0, x1, y1) fractions of the frame the detector sees, e.g. (0, 1/3, 1, 1): lower two thirds
+INFERENCE_SIZE = None  # (width, height) the detector's input is resized to, once, on the host; None keeps the ROI's size
+CAPTURE_BACKEND = "opencv"  # opencv (VideoCapture on the device) or a GStreamer backend from gst_capture.py
+CAMERA_GRABBER = True  # drain cameras on a grabber thread and use only the newest frame (see CameraSource)
+
+class FpsMeter:
+    """Events per second over a short sliding window."""
+    def __init__(self, window=2.0):
+        self.window = window
+        self.ticks = deque()
+    
+    def tick(self):
+        now = time.monotonic()
+        self.ticks.append(now)
+        while self.ticks and now - self.ticks[0] > self.window:
+            self.ticks.popleft()
+    
+    def rate(self):
+        if len(self.ticks) < 2:
+            return 0.0
+        span = self.ticks[-1] - self.ticks[0]
+        return (len(self.ticks) - 1) / span if span > 0 else 0.0
+
+class FrameScheduler:
+    """
+    Pace the capture loop to a target FPS. The wait only covers whatever is left
+    of the frame period after processing, and a loop that has fallen more than
+    a period behind resyncs instead of bursting to catch up.
+    """
+    def __init__(self, target_fps):
+        self.period = 1.0 / target_fps
+        self.next_tick = None
+    
+    async def wait(self):
+        now = time.monotonic()
+        if self.next_tick is None or now - self.next_tick > self.period:
+            self.next_tick = now
+        delay = self.next_tick - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.next_tick += self.period
+
+class FramePacket:
+    """A camera frame and everything derived from it on its way through the pipeline."""
+    def __init__(self, frame, captured_at, frame_index=0):
+        self.frame = frame
+        self.captured_at = captured_at
+        self.frame_index = frame_index
+        self.prompt = None
+        self.tree_output = None
+        self.valid_boxes = []
+        self.jpeg = None
+        self.to_frame = None  # (scale, offset) taking boxes in this packet's frame to the camera frame
+
+class DropOldestQueue(asyncio.Queue):
+    """Bounded queue whose producer never waits: a full queue sheds its oldest item."""
+    def __init__(self, maxsize):
+        super().__init__(maxsize=maxsize)
+        self.dropped = 0
+    
+    def put_latest(self, item):
+        if self.full():
+            self.get_nowait()
+            self.dropped += 1
+        self.put_nowait(item)
+
+def robot_stationary():
+    return last_movement_command in (None, 'stop')
+
+class SceneChangeGate:
+    """
+    Decides whether a frame is worth a detector run. The frame is shrunk to a
+    small grey thumbnail (one area resize, well under a millisecond) and
+    compared with the thumbnail of the last frame that was detected; a pixel
+    has changed if it moved by more than PIXEL_DELTA grey levels, which sensor
+    noise averaged over the resize does not reach. While the robot is stopped,
+    frames with fewer than SCENE_CHANGE_THRESHOLD of their pixels changed are
+    skipped, and streamed with the propagated tracks like any other undetected
+    frame, until SCENE_MAX_INTERVAL has passed. A moving robot's frames always
+    pass.
+    """
+    SIZE = (64, 48)
+    PIXEL_DELTA = 12
+    
+    def __init__(self):
+        self.reference = None  # thumbnail of the last frame let through
+        self.reference_at = None
+        self.passed = 0
+        self.skipped = 0
+        self.difference = 0.0  # changed fraction of the last frame checked
+    
+    def thumbnail(self, frame):
+        small = cv2.resize(frame, self.SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+    
+    def check(self, frame, captured_at):
+        """True if the frame should go to the detector. Only called for frames
+        the pipeline would otherwise detect."""
+        if not SCENE_GATE:
+            return True
+        thumbnail = self.thumbnail(frame)
+        if self.reference is not None:
+            self.difference = float((np.abs(thumbnail - self.reference) > self.PIXEL_DELTA).mean())
+        if (self.reference is None or not robot_stationary() or
+                self.difference > SCENE_CHANGE_THRESHOLD or
+                captured_at - self.reference_at >= SCENE_MAX_INTERVAL):
+            self.reference, self.reference_at = thumbnail, captured_at
+            self.passed += 1
+            return True
+        self.skipped += 1
+        return False
+    
+    def stats(self, infer_latency):
+        """Counts, plus the detector time the skipped frames would have cost at
+        the mean time of the detections that did run."""
+        mean_infer = infer_latency.total / infer_latency.count if infer_latency.count else 0.0
+        checked = self.passed + self.skipped
+        return {
+            "passed": self.passed,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / checked, 3) if checked else None,
+            "gpu_seconds_saved": round(self.skipped * mean_infer, 3),
+            "difference": round(self.difference, 4)
+        }
+
+def prepare_inference_frame(frame, ring):
+    """
+    The detector's input for a camera frame: the INFERENCE_ROI crop, resized
+    to INFERENCE_SIZE in a single pass straight into a ring buffer (just
+    copied there, with neither set). Also returns the (scale, offset) that
+    takes boxes in that image back to frame coordinates, or None when the
+    two are the same.
+    """
+    if INFERENCE_ROI is None and INFERENCE_SIZE is None:
+        return ring.copy(frame), None
+    height, width = frame.shape[:2]
+    x0, y0, x1, y1 = INFERENCE_ROI or (0.0, 0.0, 1.0, 1.0)
+    left, top = int(round(x0 * width)), int(round(y0 * height))
+    right, bottom = int(round(x1 * width)), int(round(y1 * height))
+    crop = frame[top:bottom, left:right]
+    if INFERENCE_SIZE is None:
+        image = ring.copy(crop)
+    else:
+        image = ring.take((INFERENCE_SIZE[1], INFERENCE_SIZE[0], 3))
+        cv2.resize(crop, INFERENCE_SIZE, dst=image, interpolation=cv2.INTER_LINEAR)
+    scale = np.array([(right - left) / image.shape[1], (bottom - top) / image.shape[0]] * 2)
+    offset = np.array([left, top, left, top], dtype=np.float64)
+    return image, (scale, offset)
+
+def boxes_to_frame(detections, scale, offset):
+    """Detections with their boxes mapped from the inference image to frame coordinates, all in one array op."""
+    if not detections:
+        return detections
+    boxes = np.array([detection.box for detection in detections], dtype=np.float64) * scale + offset
+    return [
+        TreeDetection(id=detection.id, parent_id=detection.parent_id, box=tuple(box),
+                      labels=detection.labels, scores=detection.scores)
+        for detection, box in zip(detections, boxes.tolist())
+    ]
+
+def run_inference(packet, stage_latency):
+    """Preprocess and run the predictor on one frame. Runs on the inference thread.
+    With BGR input, colour conversion and normalisation happen on the device
+    inside predict, so "preprocess" only covers wrapping the frame."""
+    start = time.perf_counter()
+    image = BgrFrame(packet.frame) if BGR_INPUT else cv2_to_pil(packet.frame)
+    stage_latency["preprocess"].add(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    # The replay predictor looks detections up by frame number instead of running a model,
+    # and needs to know where the image was cropped from to place them in it
+    replay_args = {"frame_index": packet.frame_index, "to_frame": packet.to_frame} if isinstance(predictor, ReplayPredictor) else {}
+    tree_output = predictor.predict(
+        image,
+        tree=packet.prompt['tree'],
+        clip_text_encodings=packet.prompt['clip_encodings'],
+        owl_text_encodings=packet.prompt['owl_encodings'],
+        **replay_args
+    )
+    stage_latency["infer"].add(time.perf_counter() - start)
+    return tree_output
+
+def update_tracks(packet, tracks, stage_latency):
+    """Merge detections and update tracks. Runs on the track thread."""
+    start = time.perf_counter()
+    detections = list(packet.tree_output.detections)
+    non_image_dets = [d for d in detections if d.id != 0]
+    if len(non_image_dets) > 1:
+        detections = merge_overlapping_boxes(detections, iou_threshold=0.6)
+    stage_latency["merge"].add(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    label_map = packet.prompt['tree'].get_label_map()
+    packet.valid_boxes = update_tracked_boxes(detections, label_map, packet.captured_at, tracks)
+    stage_latency["tracker"].add(time.perf_counter() - start)
+
+def overlay_frame(packet, tracks, stage_latency):
+    """Draw tracks propagated to this frame's capture time. Runs on the overlay thread."""
+    start = time.perf_counter()
+    packet.valid_boxes = tracks.predicted_boxes(packet.captured_at)
+    stage_latency["propagate"].add(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    draw_tracked_boxes(packet.frame, packet.valid_boxes)
+    stage_latency["draw"].add(time.perf_counter() - start)
+
+def encode_frame(packet, levels=()):
+    """
+    Encode the frame once per stream level in use; the broadcaster shares each
+    encoding with every client on that level. Level 0 is always encoded, for
+    the recorder and for clients that have just changed level.
+    """
+    frames = {}
+    for level in sorted(set(levels) | {0}):
+        quality, scale = STREAM_LEVELS[level]
+        frame = packet.frame
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        frames[level] = jpeg_encoder.encode(frame, max(10, int(jpeg_encoder.quality * quality)))
+    return frames
+
+def camera_spec(device):
+    """
+    What to open for a --camera device under CAPTURE_BACKEND: a GStreamer
+    pipeline that resizes and converts to width x height before frames reach
+    Python, or the device itself for the OpenCV backend (and when this OpenCV
+    was built without GStreamer).
+    """
+    if CAPTURE_BACKEND == "opencv" or is_pipeline(device):
+        return device
+    pipeline = capture_pipeline(CAPTURE_BACKEND, device, width, height, TARGET_FPS)
+    if pipeline is None:
+        print(f"⚠️ OpenCV has no GStreamer support, opening camera {device} with the OpenCV backend")
+        return device
+    print(f"📷 Camera {device}: {pipeline}")
+    return pipeline
+
+def default_frame_source():
+    """The configured replay source, or else the camera. Runs on the capture thread."""
+    if FRAME_SOURCE is not None:
+        return open_frame_source(FRAME_SOURCE, realtime=REPLAY_REALTIME, fps=REPLAY_FPS)
+    return open_frame_source(CAMERA_DEVICE, width, height, grab=CAMERA_GRABBER)
+
+class FramePipeline:
+    """
+    One camera's stream. Every frame goes capture -> overlay -> encode at
+    camera rate, drawn with the tracks propagated to its capture time; when
+    the detector is free the newest frame also goes infer -> track to correct
+    the tracks. Stages run on their own worker threads, joined by drop-oldest
+    queues.
+    """
+    GLASS_POINTS = ("read", "detect", "decision", "stream")  # capture-to-glass latency, live sources only
+    # track and overlay are whole stages including the thread hop; merge/tracker
+    # and propagate/draw are the work inside them
+    STAGES = ("capture", "prepare", "preprocess", "infer", "track", "merge", "tracker",
+              "overlay", "propagate", "draw", "encode")
+    
+    def __init__(self, broadcaster, queue_depths=None, source_factory=None, lockstep=None, tracks=None, primary=True):
+        self.broadcaster = broadcaster
+        self.source_factory = source_factory or default_frame_source
+        self.tracks = track_table if tracks is None else tracks
+        # Only the primary camera drives autonomous control and is recorded
+        self.primary = primary
+        # Lockstep (file sources at max speed): nothing is skipped or dropped, so
+        # a replay produces the same tracks and decisions every run
+        self.lockstep = (FRAME_SOURCE is not None and not REPLAY_REALTIME) if lockstep is None else lockstep
+        depths = dict(PIPELINE_QUEUE_DEPTHS, **(queue_depths or {}))
+        self.queues = {name: DropOldestQueue(depth) for name, depth in depths.items()}
+        self.executors = {
+            name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+            for name in ("capture", "track", "overlay", "encode")
+        }
+        self.stage_latency = {name: LatencyStats() for name in self.STAGES}
+        self.glass_latency = {point: LatencyStats() for point in self.GLASS_POINTS}
+        self.source = None
+        self.live = False
+        # Reused frame memory: capture reads into one ring, inference copies into another
+        self.capture_ring = FrameRing(depths["overlay"] + depths["encode"] + 4)
+        self.infer_ring = FrameRing(depths["infer"] + 2, pinned=True)
+        self.scheduler = FrameScheduler(TARGET_FPS)
+        self.fps = {name: FpsMeter() for name in ("capture", "inference", "stream")}
+        self.inferring = False
+        self.gate = SceneChangeGate()
+        self.skipped_inference = 0
+        self.last_inference_at = float("-inf")
+    
+    async def run_stage(self, name, fn, *args):
+        """Run fn on the stage's worker thread and record how long it took."""
+        start = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.executors[name], fn, *args)
+        self.stage_latency[name].add(time.perf_counter() - start)
+        return result
+    
+    def glass(self, point, packet):
+        """Record how long ago packet's frame was captured. Only live sources
+        have capture times on the monotonic clock."""
+        if self.live:
+            self.glass_latency[point].add(time.monotonic() - packet.captured_at)
+    
+    async def put(self, name, packet):
+        if self.lockstep:
+            await self.queues[name].put(packet)
+        else:
+            self.queues[name].put_latest(packet)
+    
+    async def capture_stage(self):
+        source = await asyncio.get_running_loop().run_in_executor(
+            self.executors["capture"], self.source_factory
+        )
+        source.ring = self.capture_ring
+        self.source = source
+        self.live = source.live
+        try:
+            while True:
+                item = await self.run_stage("capture", source.read)
+                if item is None:
+                    print("📼 Frame source finished, stopping stream")
+                    break
+                frame, captured_at, frame_index = item
+                self.fps["capture"].tick()
+                packet = FramePacket(frame, captured_at, frame_index)
+                self.glass("read", packet)
+                
+                if prompt_data is None:
+                    pass
+                elif self.lockstep:
+                    if (captured_at - self.last_inference_at >= DETECTION_INTERVAL and
+                            self.gate.check(frame, captured_at)):
+                        self.last_inference_at = captured_at
+                        await self.detect(self.inference_packet(packet))
+                    else:
+                        self.skipped_inference += 1
+                elif (self.inferring or not self.queues["infer"].empty() or
+                      captured_at - self.last_inference_at < DETECTION_INTERVAL or
+                      not self.gate.check(frame, captured_at)):
+                    # No detection for this frame: stream it with the propagated tracks
+                    self.skipped_inference += 1
+                else:
+                    self.last_inference_at = captured_at
+                    self.queues["infer"].put_latest(self.inference_packet(packet))
                 
-            image_pil = cv2_to_pil(frame)
+                await self.put("overlay", packet)
+                if source.live:
+                    await self.scheduler.wait()
+        finally:
+            # On the capture thread: a read still in flight there finishes first
+            # (VideoCapture.read and release must not overlap), and joining a
+            # grabber thread does not block the event loop. Shielded so the
+            # release still runs if this task is cancelled again meanwhile
+            await asyncio.shield(asyncio.get_running_loop().run_in_executor(self.executors["capture"], source.release))
+            self.queues["infer"].put_latest(None)
+            await self.put("overlay", None)
+    
+    def inference_packet(self, packet):
+        """A packet for the detector with its own copy (or ROI crop/resize) of the
+        frame, so the overlay can draw on the original."""
+        start = time.perf_counter()
+        image, to_frame = prepare_inference_frame(packet.frame, self.infer_ring)
+        inference = FramePacket(image, packet.captured_at, packet.frame_index)
+        inference.to_frame = to_frame
+        self.stage_latency["prepare"].add(time.perf_counter() - start)
+        return inference
+    
+    async def detect(self, packet):
+        """Run the detector on a packet and correct the tracks with the result."""
+        packet.prompt = prompt_data
+        self.inferring = True
+        try:
+            packet.tree_output = await inference_worker.run(run_inference, packet, self.stage_latency)
+            if packet.to_frame is not None:
+                packet.tree_output = TreeOutput(detections=boxes_to_frame(packet.tree_output.detections, *packet.to_frame))
+            self.glass("detect", packet)
+            self.fps["inference"].tick()
+            if session_recorder and self.primary:
+                # Raw detections, before update_tracks merges them in place
+                session_recorder.record_detections(
+                    packet.frame_index, packet.captured_at,
+                    packet.tree_output.detections, packet.prompt['tree'].get_label_map()
+                )
             
-            if prompt_data is not None:
+            await self.run_stage("track", update_tracks, packet, self.tracks, self.stage_latency)
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+        finally:
+            self.inferring = False
+    
+    async def infer_stage(self):
+        while True:
+            packet = await self.queues["infer"].get()
+            if packet is None:
+                return
+            await self.detect(packet)
+    
+    async def overlay_stage(self):
+        while True:
+            packet = await self.queues["overlay"].get()
+            if packet is not None and prompt_data is not None:
                 try:
-                    tree_output = predictor.predict(
-                        image_pil,
-                        tree=prompt_data['tree'],
-                        clip_text_encodings=prompt_data['clip_encodings'],
-                        owl_text_encodings=prompt_data['owl_encodings']
-                    )
-                    
-                    detections = list(tree_output.detections)
-                    non_image_dets = [d for d in detections if d.id != 0]
-                    if len(non_image_dets) > 1:
-                        merged_detections = merge_overlapping_boxes(detections, iou_threshold=0.6)
-                        tree_output = TreeOutput(detections=merged_detections)
-                    
-                    # Get valid tracked boxes
-                    label_map = prompt_data['tree'].get_label_map()
-                    valid_boxes = update_tracked_boxes(tree_output.detections, label_map)
-                    
                     # Draw only valid tracked boxes
-                    is_pil = not isinstance(frame, np.ndarray)
-                    if is_pil:
-                        frame = np.asarray(frame)
-                    
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    font_scale = 0.75
-                    
-                    for tracked_box in valid_boxes:
-                        box = [int(x) for x in tracked_box.box]
-                        pt0 = (box[0], box[1])
-                        pt1 = (box[2], box[3])
-                        
-                        # Color based on whether it's a target or obstacle
-                        is_target = any(label in prompt_data['target_objects'] for label in tracked_box.labels)
-                        is_obstacle = any(label in prompt_data['obstacles'] for label in tracked_box.labels)
-                        
-                        if is_target:
-                            color = (107, 107, 255)  # #ff6b6b in BGR
-                        elif is_obstacle:
-                            color = (251, 218, 97)   # #61dafb in BGR
-                        else:
-                            color = (128, 128, 128)  # Gray for other objects
-                        
-                        # Draw bounding box
-                        cv2.rectangle(
-                            frame,
-                            pt0,
-                            pt1,
-                            color,
-                            1
-                        )
-                        
-                        # Draw labels with confidence scores
-                        offset_y = 30
-                        offset_x = 8
-                        for i, label in enumerate(tracked_box.labels):
-                            label_text = f"{label} ({tracked_box.scores[i]*100:.1f}%)"
-                            cv2.putText(
-                                frame,
-                                label_text,
-                                (box[0] + offset_x, box[1] + offset_y),
-                                font,
-                                font_scale,
-                                color,
-                                2,  # thickness
-                                cv2.LINE_AA
-                            )
-                            offset_y += 18
+                    await self.run_stage("overlay", overlay_frame, packet, self.tracks, self.stage_latency)
                     
-                    if is_pil:
-                        frame = PIL.Image.fromarray(frame)
-                        
                     # Add autonomous movement processing after drawing
-                    if autonomous_control_enabled:
-                        await process_autonomous_movement(valid_boxes, width)
-                    
+                    if autonomous_control_enabled and self.primary:
+                        await process_autonomous_movement(packet.valid_boxes, packet.frame.shape[1])
+                        self.glass("decision", packet)
                 except Exception as e:
                     print(f"Error processing frame: {e}")
+            await self.put("encode", packet)
+            if packet is None:
+                return
+    
+    async def encode_stage(self):
+        while True:
+            packet = await self.queues["encode"].get()
+            if packet is None:
+                self.broadcaster.publish(None)
+                return
+            frames = await self.run_stage("encode", encode_frame, packet, self.broadcaster.levels_in_use())
+            packet.jpeg = frames[0]
+            self.broadcaster.publish(frames)
+            self.glass("stream", packet)
+            if session_recorder and self.primary:
+                session_recorder.record_frame(packet.frame_index, packet.captured_at, packet.jpeg)
+                session_recorder.record_tracks(packet.frame_index, packet.captured_at, packet.valid_boxes)
+            self.fps["stream"].tick()
+    
+    async def run(self):
+        stages = [
+            asyncio.create_task(self.capture_stage()),
+            asyncio.create_task(self.infer_stage()),
+            asyncio.create_task(self.overlay_stage()),
+            asyncio.create_task(self.encode_stage())
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except Exception as e:
+            print(f"Stream error: {e}")
+            self.broadcaster.publish(None)
+            for stage in stages:
+                stage.cancel()
+        finally:
+            # If this task was cancelled, gather has already cancelled the stages;
+            # cancelling them again would interrupt their cleanup. Either way, let
+            # that cleanup finish on their executors before those shut down
+            await asyncio.gather(*stages, return_exceptions=True)
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+    
+    def stats(self):
+        return {
+            "stages": {name: stats.summary() for name, stats in self.stage_latency.items()},
+            "glass_to": {point: stats.summary() for point, stats in self.glass_latency.items() if stats.count},
+            "source": self.source.stats() if self.source else None,
+            "dropped": {name: queue.dropped for name, queue in self.queues.items()},
+            "skipped_inference": self.skipped_inference,
+            "scene_gate": self.gate.stats(self.stage_latency["infer"]),
+            "frame_buffers_allocated": self.capture_ring.allocations + self.infer_ring.allocations,
+            "target_fps": TARGET_FPS,
+            "jpeg_encoder": jpeg_encoder.name,
+            "fps": {name: round(meter.rate(), 1) for name, meter in self.fps.items()}
+        }
+
+async def handle_video_stream(request):
+    # /video-feed is the primary camera, /video-feed/<id> any of them
+    camera = request.match_info.get("camera")
+    broadcaster = frame_broadcaster if camera is None else frame_broadcasters.get(camera)
+    if broadcaster is None:
+        raise web.HTTPNotFound(text=f"No camera {camera!r}; cameras: {', '.join(frame_broadcasters)}")
+    
+    response = web.StreamResponse()
+    response.content_type = 'multipart/x-mixed-replace; boundary=frame'
+    response.headers['Cache-Control'] = 'no-cache'
+    await response.prepare(request)
+    
+    # A default-sized kernel buffer would hide seconds of backlog from a slow client
+    sock = request.transport.get_extra_info("socket") if request.transport else None
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SOCKET_BUFFER)
+    
+    # ?adaptive=0 keeps a client at full quality however slow it is
+    adaptive = request.query.get("adaptive", "1") not in ("0", "false")
+    client = broadcaster.subscribe(request.remote, adaptive)
+    print(f"📺 Stream client connected to camera {camera or 'primary'} ({len(broadcaster.subscribers)} active)")
+    
+    try:
+        await broadcaster.start()
+        while True:
+            frames = await client.queue.get()
+            if frames is None:
+                break
             
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, IMAGE_QUALITY])
-            bytes_buffer = buffer.tobytes()
+            # Skip frames while the socket still holds earlier ones, rather than queueing more
+            buffered = request.transport.get_write_buffer_size() if request.transport else 0
+            if buffered > STREAM_MAX_BUFFERED:
+                client.skipped += 1
+                broadcaster.skipped += 1
+                client.observe(0.0, buffered, 0)
+                continue
             
+            jpeg = client.pick(frames)
+            start = time.perf_counter()
             await response.write(
                 b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + bytes_buffer + b'\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
             )
+            client.sent += 1
+            client.observe(time.perf_counter() - start,
+                           request.transport.get_write_buffer_size() if request.transport else 0, len(jpeg))
             
-            await asyncio.sleep(0.03)  # Approximately 30 FPS
-            
+    except ConnectionResetError:
+        pass
     except Exception as e:
         print(f"Stream error: {e}")
     finally:
-        camera.release()
+        broadcaster.unsubscribe(client)
+        print(f"📺 Stream client disconnected from camera {camera or 'primary'} ({len(broadcaster.subscribers)} active)")
     
     return response
 
@@ -613,9 +2185,7 @@ async def handle_prompt_update(request):
         if obstacles:
             print(f"🚫 Obstacles: {', '.join(obstacles)}")
         
-        tree = Tree.from_prompt(new_prompt)
-        clip_encodings = predictor.encode_clip_text(tree)
-        owl_encodings = predictor.encode_owl_text(tree)
+        tree, clip_encodings, owl_encodings = await inference_worker.run(encode_prompt, new_prompt)
         prompt_data = {
             "tree": tree,
             "clip_encodings": clip_encodings,
@@ -693,30 +2263,132 @@ async def handle_control(request):
             text=f'Error processing control command: {str(e)}'
         )
 
+async def start_command_writer(app: web.Application):
+    if command_writer.port is None:
+        command_writer.open()
+    command_writer.start_reader()
+    app['command_writer'] = asyncio.create_task(command_writer.run())
+
+async def stop_command_writer(app: web.Application):
+    app['command_writer'].cancel()
+    command_writer.executor.shutdown(wait=False)
+    command_writer.close()
+
+async def stop_recorder(app: web.Application):
+    if session_recorder:
+        session_recorder.close()
+        print(f"📼 Session saved to {session_recorder.root}")
+
 async def on_shutdown(app: web.Application):
     for ws in set(app['websockets']):
         await ws.close(code=WSCloseCode.GOING_AWAY,
                       message='Server shutdown')
+    inference_worker.shutdown()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("image_encode_engine", type=str)
+    parser.add_argument("image_encode_engine", type=str, nargs="?",
+                        help="OWL image encoder engine (not needed with --replay-detections)")
     parser.add_argument("--image_quality", type=int, default=50)
+    parser.add_argument("--jpeg-encoder", choices=["auto"] + list(ENCODERS), default="auto",
+                        help="Stream JPEG backend; auto picks simplejpeg or turbojpeg when installed, else opencv")
     parser.add_argument("--port", type=int, default=7860)
     parser.add_argument("--host", type=str, default="0.0.0.0")
-    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--camera", type=str, nargs="+", default=["0"],
+                        help="Camera index or device, or NAME=DEVICE; several for several cameras, each streamed at "
+                             "/video-feed/<NAME or position>. The first one drives and is also /video-feed")
     parser.add_argument("--resolution", type=str, default="640x480", help="Camera resolution as WIDTHxHEIGHT")
+    parser.add_argument("--capture-backend", choices=["opencv"] + list(GST_BACKENDS), default="opencv",
+                        help="gstreamer: V4L2/file pipeline (hardware resize/convert on a Jetson); nvargus: CSI camera")
+    parser.add_argument("--direct-capture", action="store_true",
+                        help="Read cameras on the capture thread instead of through the newest-frame grabber thread")
+    parser.add_argument("--source", type=str, default=None,
+                        help="Play a video file, image directory or recorded session instead of the camera")
+    parser.add_argument("--replay-speed", choices=["realtime", "max"], default="realtime",
+                        help="Play --source at its recorded rate, or as fast as possible (deterministic lockstep)")
+    parser.add_argument("--replay-fps", type=float, default=30, help="Frame rate for an image directory --source")
+    parser.add_argument("--pil-input", action="store_true",
+                        help="Feed the predictor PIL images (the old cv2_to_pil path) instead of BGR frames")
+    parser.add_argument("--record", type=str, default=None,
+                        help="Record frames, detections, tracks and commands to a new session under this directory")
+    parser.add_argument("--replay-detections", type=str, default=None,
+                        help="Recorded session whose detections replace the detector (no GPU needed)")
+    parser.add_argument("--embedding-store", type=str, default=DEFAULT_STORE_DIR,
+                        help="Directory of cached text embeddings (empty string to disable)")
+    parser.add_argument("--no-scene-gate", action="store_true",
+                        help="Run the detector on every eligible frame even while the robot is stopped and the scene is still")
+    parser.add_argument("--scene-threshold", type=float, default=SCENE_CHANGE_THRESHOLD,
+                        help="Fraction of thumbnail pixels that must change to count as a scene change")
+    parser.add_argument("--roi", type=str, default=None,
+                        help="Part of the frame the detector sees, as x0,y0,x1,y1 fractions (e.g. 0,0.33,1,1)")
+    parser.add_argument("--infer-size", type=str, default=None,
+                        help="Resize the detector's input (after --roi) to WIDTHxHEIGHT once, on the host")
+    parser.add_argument("--fps", type=float, default=30, help="Target capture/stream FPS")
+    parser.add_argument("--detect-fps", type=float, default=0,
+                        help="Cap on detector runs per second; tracks are propagated in between (0 = no cap)")
+    parser.add_argument("--queue-depths", type=str, default="infer:1,overlay:2,encode:2",
+                        help="Pipeline queue depths as STAGE:DEPTH pairs, e.g. infer:1,overlay:2,encode:2")
+    parser.add_argument("--serial", type=str, default=SERIAL_DEVICE,
+                        help="ESP32 link: device path or pyserial URL (e.g. the pty printed by fake_esp32.py)")
+    parser.add_argument("--motor-speed", type=int, default=MOTOR_SPEED, help="Motor PWM duty (0-255)")
     args = parser.parse_args()
+    if not args.image_encode_engine and not args.replay_detections:
+        parser.error("image_encode_engine is required unless --replay-detections is given")
     width, height = map(int, args.resolution.split("x"))
+    for pair in args.queue_depths.split(","):
+        stage, depth = pair.split(":")
+        PIPELINE_QUEUE_DEPTHS[stage.strip()] = int(depth)
 
-    CAMERA_DEVICE = args.camera
+    cameras = []
+    CAPTURE_BACKEND = args.capture_backend
+    TARGET_FPS = args.fps
+    for position, spec in enumerate(args.camera):
+        # A GStreamer pipeline has "=" in it too, but no bare name before the first one
+        name, _, device = spec.partition("=")
+        if not name.isidentifier():
+            name, device = "", spec
+        cameras.append((name or str(position), camera_spec(int(device) if device.isdigit() else device)))
+    CAMERA_DEVICE = cameras[0][1]
+    CAMERA_GRABBER = not args.direct_capture
+    FRAME_SOURCE = args.source
+    REPLAY_REALTIME = args.replay_speed == "realtime"
+    REPLAY_FPS = args.replay_fps
+    DETECTION_INTERVAL = 1.0 / args.detect_fps if args.detect_fps > 0 else 0.0
+    SCENE_GATE = not args.no_scene_gate
+    SCENE_CHANGE_THRESHOLD = args.scene_threshold
+    if args.roi:
+        INFERENCE_ROI = tuple(float(v) for v in args.roi.split(","))
+    if args.infer_size:
+        INFERENCE_SIZE = tuple(map(int, args.infer_size.split("x")))
     IMAGE_QUALITY = args.image_quality
+    jpeg_encoder = make_encoder(args.jpeg_encoder, IMAGE_QUALITY)
+    print(f"🖼️ JPEG encoder: {jpeg_encoder.name}")
+    SERIAL_DEVICE = args.serial
+    frame_broadcasters = {cameras[0][0]: frame_broadcaster}
+    for name, device in cameras[1:]:
+        frame_broadcasters[name] = FrameBroadcaster(
+            functools.partial(open_frame_source, device, width, height, REPLAY_REALTIME, REPLAY_FPS, CAMERA_GRABBER),
+            tracks=TrackTable(), primary=False
+        )
+    if len(cameras) > 1:
+        print(f"📷 Cameras: {', '.join(f'{name} ({device})' for name, device in cameras)}; {cameras[0][0]} drives")
+    if args.record:
+        session_recorder = SessionRecorder(os.path.join(args.record, datetime.now().strftime("%Y-%m-%d_%H%M%S")))
+        print(f"📼 Recording session to {session_recorder.root}")
+    command_writer.speed = max(0, min(255, args.motor_speed))
 
-    predictor = TreePredictor(
-        owl_predictor=OwlPredictor(
-            image_encoder_engine=args.image_encode_engine
+    if args.replay_detections:
+        predictor = ReplayPredictor(args.replay_detections)
+        print(f"📼 Replaying detections from {args.replay_detections}")
+    else:
+        predictor = TreePredictor(
+            owl_predictor=OwlPredictor(
+                image_encoder_engine=args.image_encode_engine
+            )
         )
-    )
+    BGR_INPUT = not args.pil_input and install_bgr_input(predictor)
+    if args.embedding_store and not args.replay_detections:
+        prompt_cache.disk_stores = open_stores(args.embedding_store, args.image_encode_engine)
 
     # Set default prompt data with multiple target objects for survivor detection
     default_targets = ["a face", "a hand", "a foot", "an arm", "glasses"]
@@ -727,9 +2399,7 @@ if __name__ == "__main__":
     default_prompt = f"[{', '.join(all_objects)}]"
     
     # Initialize with default values
-    tree = Tree.from_prompt(default_prompt)
-    clip_encodings = predictor.encode_clip_text(tree)
-    owl_encodings = predictor.encode_owl_text(tree)
+    tree, clip_encodings, owl_encodings = encode_prompt(default_prompt)
     
     prompt_data = {
         "tree": tree,
@@ -743,22 +2413,23 @@ if __name__ == "__main__":
     
     print(f"🎯 Default Target (Survivor indicators): {', '.join(default_targets)}")
     print(f"🚫 Default Obstacles: {', '.join(default_obstacles)}")
-    app = web.Application(middlewares=[cors_middleware])
+    app = web.Application(middlewares=[cors_middleware, latency_middleware])
     app['websockets'] = weakref.WeakSet()
     
     # Routes
     app.router.add_get("/", handle_index_get)
     app.router.add_route("GET", "/ws", websocket_handler)
     app.router.add_get("/video-feed", handle_video_stream)
+    app.router.add_get("/video-feed/{camera}", handle_video_stream)
     app.router.add_post("/update-prompt", handle_prompt_update)
     app.router.add_post("/control", handle_control)
     app.router.add_post("/motor-control", handle_motor_control)
     app.router.add_post("/autonomous-control", handle_autonomous_control)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/metrics", handle_metrics)
     
+    app.on_startup.append(start_command_writer)
     app.on_shutdown.append(on_shutdown)
-    try:
-        web.run_app(app, host=args.host, port=args.port)
-    finally:
-        if serial_port:
-            serial_port.close()
-            print("🔌 Serial connection closed")
\ No newline at end of file
+    app.on_cleanup.append(stop_command_writer)
+    app.on_cleanup.append(stop_recorder)
+    web.run_app(app, host=args.host, port=args.port)
\ No newline at end of file
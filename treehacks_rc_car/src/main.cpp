@@ -13,6 +13,34 @@ const unsigned int EN_B = 14;
 #define UART_RX2 16
 #define UART_TX2 17
 
+// PWM on the L298N enable pins (LEDC channel 0 is left for the servo)
+const int PWM_CHANNEL_A = 2;
+const int PWM_CHANNEL_B = 3;
+const int PWM_FREQUENCY = 20000; // Hz
+const int PWM_RESOLUTION = 8;    // bits, duty 0-255
+
+// Binary framed protocol, must stay in sync with jetson/serial_protocol.py
+// command: 0xA5 | seq | opcode | speed | crc8(seq, opcode, speed)
+// ack:     0x5A | seq | status | opcode | rx_errors | crc8(seq, status, opcode, rx_errors)
+const uint8_t COMMAND_SYNC = 0xA5;
+const uint8_t ACK_SYNC = 0x5A;
+const uint8_t COMMAND_FRAME_SIZE = 5;
+
+const uint8_t OP_STOP = 0x00;
+const uint8_t OP_FORWARD = 0x01;
+const uint8_t OP_BACKWARD = 0x02;
+const uint8_t OP_TURN_LEFT = 0x03;
+const uint8_t OP_TURN_RIGHT = 0x04;
+
+const uint8_t STATUS_OK = 0x00;
+const uint8_t STATUS_BAD_CHECKSUM = 0x01;
+const uint8_t STATUS_BAD_OPCODE = 0x02;
+
+uint8_t frameBuffer[COMMAND_FRAME_SIZE];
+uint8_t frameLength = 0;
+uint8_t rxErrors = 0;
+uint8_t motorSpeed = 255;
+
 unsigned long lastCommandTime = 0;
 
 void setup() {
@@ -20,47 +48,51 @@ void setup() {
     Serial2.begin(115200, SERIAL_8N1, UART_RX2, UART_TX2);  // UART control
     
     // Initialize motor pins
-    pinMode(EN_A, OUTPUT);
     pinMode(IN1_A, OUTPUT);
     pinMode(IN2_A, OUTPUT);
-    pinMode(EN_B, OUTPUT);
     pinMode(IN1_B, OUTPUT);
     pinMode(IN2_B, OUTPUT);
+
+    // Enable pins are driven by PWM so the speed byte sets motor duty
+    ledcSetup(PWM_CHANNEL_A, PWM_FREQUENCY, PWM_RESOLUTION);
+    ledcAttachPin(EN_A, PWM_CHANNEL_A);
+    ledcSetup(PWM_CHANNEL_B, PWM_FREQUENCY, PWM_RESOLUTION);
+    ledcAttachPin(EN_B, PWM_CHANNEL_B);
 }
 
 // Basic motor control functions
 void forwardA() {
-    digitalWrite(EN_A, HIGH);
+    ledcWrite(PWM_CHANNEL_A, motorSpeed);
     digitalWrite(IN1_A, HIGH);
     digitalWrite(IN2_A, LOW);
 }
 
 void backwardA() {
-    digitalWrite(EN_A, HIGH);
+    ledcWrite(PWM_CHANNEL_A, motorSpeed);
     digitalWrite(IN1_A, LOW);
     digitalWrite(IN2_A, HIGH);
 }
 
 void stopA() {
-    digitalWrite(EN_A, LOW);
+    ledcWrite(PWM_CHANNEL_A, 0);
     digitalWrite(IN1_A, LOW);
     digitalWrite(IN2_A, LOW);
 }
 
 void forwardB() {
-    digitalWrite(EN_B, HIGH);
+    ledcWrite(PWM_CHANNEL_B, motorSpeed);
     digitalWrite(IN1_B, HIGH);
     digitalWrite(IN2_B, LOW);
 }
 
 void backwardB() {
-    digitalWrite(EN_B, HIGH);
+    ledcWrite(PWM_CHANNEL_B, motorSpeed);
     digitalWrite(IN1_B, LOW);
     digitalWrite(IN2_B, HIGH);
 }
 
 void stopB() {
-    digitalWrite(EN_B, LOW);
+    ledcWrite(PWM_CHANNEL_B, 0);
     digitalWrite(IN1_B, LOW);
     digitalWrite(IN2_B, LOW);
 }
@@ -91,35 +123,101 @@ void stopAll() {
     stopB();
 }
 
-void handleUARTCommand(char cmd) {
-    switch(toupper(cmd)) {
-        case 'F': 
+// CRC-8, polynomial 0x07, init 0x00
+uint8_t crc8(const uint8_t *data, size_t length) {
+    uint8_t crc = 0;
+    for (size_t i = 0; i < length; i++) {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+        }
+    }
+    return crc;
+}
+
+void sendAck(uint8_t seq, uint8_t status, uint8_t opcode) {
+    uint8_t ack[6] = {ACK_SYNC, seq, status, opcode, rxErrors, 0};
+    ack[5] = crc8(ack + 1, 4);
+    Serial2.write(ack, sizeof(ack));
+}
+
+bool applyOpcode(uint8_t opcode, uint8_t speed) {
+    motorSpeed = speed;
+    switch(opcode) {
+        case OP_FORWARD:
             moveForward();
-            Serial.println("UART: Moving forward");
-            break;
-        case 'B':
+            Serial.printf("UART: Moving forward (speed %u)\n", speed);
+            return true;
+        case OP_BACKWARD:
             moveBackward();
-            Serial.println("UART: Moving backward");
-            break;
-        case 'R':
+            Serial.printf("UART: Moving backward (speed %u)\n", speed);
+            return true;
+        case OP_TURN_RIGHT:
             turnRight();
-            Serial.println("UART: Turning right");
-            break;
-        case 'L':
+            Serial.printf("UART: Turning right (speed %u)\n", speed);
+            return true;
+        case OP_TURN_LEFT:
             turnLeft();
-            Serial.println("UART: Turning left");
-            break;
+            Serial.printf("UART: Turning left (speed %u)\n", speed);
+            return true;
+        case OP_STOP:
+            stopAll();
+            Serial.println("UART: Stop");
+            return true;
         default:
             stopAll();
-            Serial.println("UART: Stop - Invalid command");
+            Serial.println("UART: Stop - Invalid opcode");
+            return false;
+    }
+}
+
+// Returns false if the checksum is bad, in which case the frame is not consumed
+bool handleFrame() {
+    uint8_t seq = frameBuffer[1];
+    uint8_t opcode = frameBuffer[2];
+    uint8_t speed = frameBuffer[3];
+
+    if (crc8(frameBuffer + 1, 3) != frameBuffer[4]) {
+        rxErrors++;
+        sendAck(seq, STATUS_BAD_CHECKSUM, opcode);
+        return false;
+    }
+    if (!applyOpcode(opcode, speed)) {
+        rxErrors++;
+        sendAck(seq, STATUS_BAD_OPCODE, opcode);
+        return true;
+    }
+    sendAck(seq, STATUS_OK, opcode);
+    lastCommandTime = millis();
+    return true;
+}
+
+// After a bad checksum, drop only the first byte and resume at the next sync
+// byte already buffered: if a byte was lost, the next frame may have started
+// inside this one (same as FrameParser in serial_protocol.py)
+void resync() {
+    uint8_t start = 1;
+    while (start < frameLength && frameBuffer[start] != COMMAND_SYNC) {
+        start++;
     }
+    memmove(frameBuffer, frameBuffer + start, frameLength - start);
+    frameLength -= start;
 }
 
 void loop() {
-    // Handle UART commands
-    if (Serial2.available() > 0) {
-        char cmd = Serial2.read();
-        handleUARTCommand(cmd);
-        lastCommandTime = millis();
+    // Handle UART command frames, resynchronising on the sync byte
+    while (Serial2.available() > 0) {
+        uint8_t incoming = Serial2.read();
+        if (frameLength == 0 && incoming != COMMAND_SYNC) {
+            continue;
+        }
+        frameBuffer[frameLength++] = incoming;
+        if (frameLength == COMMAND_FRAME_SIZE) {
+            if (handleFrame()) {
+                frameLength = 0;
+            } else {
+                resync();
+            }
+        }
     }
 }